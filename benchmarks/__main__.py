@@ -0,0 +1,322 @@
+"""
+Бенчмарки рендера (без интерфейса, фоны и таблицы генерируются, шрифты - из fonts/):
+
+    python -m benchmarks                       # все замеры, JSON в stdout
+    python -m benchmarks -o bench.json         # сохранить результат
+    python -m benchmarks --baseline bench.json # сравнить с сохраненным, код 1 при регрессии
+    python -m benchmarks --quick -k draw_line  # быстрый прогон только части замеров
+
+Каждый замер - лучшее время из --repeat прогонов после прогрева (кэши глифов, шрифтов и фонов
+теплые, как в середине пакета); cold_* - первый прогон на свежем Generator.
+Метрики пропускной способности: *_per_sec (больше - лучше). peak_rss_mb - пик памяти процесса
+на момент окончания замера (для batch - еще и дочерних процессов).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+from PIL import Image, ImageFont
+import PIL
+import numpy as np
+
+from core.generator import Generator, FONTS_FOLDER
+from core.layout import TextFitter
+from core.output import OutputOptions, encode_image
+from core.utils import wrap_text
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCH_FONT = "Caveat-VariableFont_wght.ttf"
+BG_SIZE = (1240, 1754) # A4 при 150 dpi
+TEXT_LENGTHS = {'short': 12, 'medium': 60, 'long': 240}
+WORDS = ("Иван Петров Москва улица Ленина дом квартира договор сумма рублей подпись "
+         "John Smith London Baker street invoice total 2024 №15 г. д. кв. 101000").split()
+
+# Значения "физики" для прогона по одному параметру (верх обычных диапазонов слайдеров)
+PHYS_SWEEP = {
+    'shakiness': 3, 'kerning': 3, 'slant': 2, 'blur': 1,
+    'height_variation': 15, 'width_variation': 10, 'distortion': 40,
+}
+PHYS_ZERO = {'shakiness': 0, 'opacity': 10, 'kerning': 0, 'slant': 0, 'blur': 0,
+             'height_variation': 0, 'width_variation': 0, 'distortion': 0}
+
+CASES = []
+
+def case(fn):
+    CASES.append(fn)
+    return fn
+
+
+def peak_rss_mb(children=False):
+    if resource is None: return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    rss = resource.getrusage(who).ru_maxrss
+    # Linux - килобайты, macOS - байты
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def best_time(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def make_text(rng, n_chars):
+    words = []
+    while sum(len(w) + 1 for w in words) < n_chars:
+        words.append(rng.choice(WORDS))
+    return " ".join(words)
+
+
+def glyph_count(text):
+    return sum(1 for c in text if not c.isspace())
+
+
+class Bench:
+    """Общие входные данные: фон, шрифт, тексты; все детерминированы"""
+
+    def __init__(self, tmp, repeat, quick):
+        self.tmp = tmp
+        self.repeat = repeat
+        self.quick = quick
+        fonts = sorted(Generator().get_fonts())
+        if not fonts: raise SystemExit(f"Нет шрифтов в {FONTS_FOLDER}")
+        self.font = BENCH_FONT if BENCH_FONT in fonts else fonts[0]
+        rng = random.Random(42)
+        self.texts = {name: make_text(rng, n) for name, n in TEXT_LENGTHS.items()}
+
+        self.bg_path = os.path.join(tmp, "bg.jpg")
+        # Немного шума, чтобы фон не сжимался/не декодировался нереально быстро
+        noise = Image.effect_noise(BG_SIZE, 12).point(lambda v: 200 + v // 5)
+        Image.merge('RGB', (noise, noise, noise.point(lambda v: v - 10))).save(self.bg_path, quality=90)
+
+    def config(self, zones=1, text='medium', render_mode='classic', phys=None, size=32):
+        """Шаблон: zones зон сеткой по листу, фиксированные (не диапазоны) параметры"""
+        glo = {'font': self.font, 'size': size, 'color': '#1414A0', 'seed': 'bench',
+               'render_mode': render_mode, **PHYS_ZERO, **(phys or {})}
+        cols = 2 if zones > 1 else 1
+        rows = (zones + cols - 1) // cols
+        w, h = (BG_SIZE[0] - 100) // cols, (BG_SIZE[1] - 100) // rows
+        zs = [{'sourceType': 'text', 'content': self.texts[text], 'font': None, 'size': size,
+               'x': 50 + (i % cols) * w, 'y': 50 + (i // cols) * h, 'width': w - 20, 'height': h - 20}
+              for i in range(zones)]
+        return json.dumps({'globals': glo, 'zones': zs})
+
+    def rows(self, n, text='medium'):
+        rng = random.Random(7)
+        return [{'ID': str(i), 'text': make_text(rng, TEXT_LENGTHS[text])} for i in range(n)]
+
+
+@case
+def bench_wrap_text(b):
+    """utils.wrap_text (старый перенос строк по словам)"""
+    font = ImageFont.truetype(os.path.join(FONTS_FOLDER, b.font), 32)
+    out = {}
+    for name, text in b.texts.items():
+        n = 20 if b.quick else 200
+        t = best_time(lambda: [wrap_text(text, font, 300) for _ in range(n)], b.repeat)
+        out[f"wrap_text/{name}"] = {'calls_per_sec': n / t}
+    return out
+
+
+@case
+def bench_fit(b):
+    """TextFitter.fit: подбор размера под зону, с пустыми кэшами и с теплыми"""
+    gen = Generator()
+    out = {}
+    for name, text in b.texts.items():
+        n = 5 if b.quick else 50
+        def cold():
+            for _ in range(n): TextFitter(gen._get_cached_font).fit(text, b.font, 60, 500, 200, 1.0)
+        fitter = TextFitter(gen._get_cached_font)
+        def warm():
+            for _ in range(n): fitter.fit(text, b.font, 60, 500, 200, 1.0)
+        out[f"fit/{name}"] = {'cold_calls_per_sec': n / best_time(cold, b.repeat),
+                              'calls_per_sec': n / best_time(warm, b.repeat)}
+    return out
+
+
+@case
+def bench_draw_line(b):
+    """_draw_line: одна строка, физика по одному параметру и все сразу, оба режима рендера"""
+    text = b.texts['short'] if b.quick else b.texts['medium']
+    glyphs = glyph_count(text)
+    sweep = [('none', {})] + [(k, {k: v}) for k, v in PHYS_SWEEP.items()] + [('all', PHYS_SWEEP)]
+    out = {}
+    for mode in ('classic', 'fused'):
+        for name, phys in sweep:
+            gen = Generator()
+            tpl = gen.compile(b.config(render_mode=mode, phys=phys))
+            canvas = Image.new('RGBA', BG_SIZE, (255, 255, 255, 0))
+            def run():
+                doc = gen._begin_doc(tpl, {'ID': 'bench'}, 0)
+                gen._draw_line(canvas, text, doc['font_pool'], 40, 50, 50, doc['phys'], doc['color'], doc['rng'])
+            cold = best_time(run, 1)
+            warm = best_time(run, b.repeat)
+            out[f"draw_line/{mode}/{name}"] = {'glyphs_per_sec': glyphs / warm, 'cold_glyphs_per_sec': glyphs / cold}
+    return out
+
+
+@case
+def bench_fit_and_draw(b):
+    """_fit_and_draw: подбор размера и рендер всех строк одной зоны (fused, чтобы был виден сам подбор)"""
+    out = {}
+    for name in ('short', 'long') if b.quick else TEXT_LENGTHS:
+        text = b.texts[name]
+        gen = Generator()
+        tpl = gen.compile(b.config(text=name, render_mode='fused', phys=PHYS_SWEEP))
+        zone = tpl.zones[0]
+        canvas = Image.new('RGBA', BG_SIZE, (255, 255, 255, 0))
+        def run():
+            doc = gen._begin_doc(tpl, {'ID': 'bench'}, 0)
+            gen._fit_and_draw(canvas, text, doc['font_pool'], zone.size, zone, doc['phys'], doc['color'], doc['rng'])
+        t = best_time(run, b.repeat)
+        out[f"fit_and_draw/{name}"] = {'zones_per_sec': 1 / t, 'glyphs_per_sec': glyph_count(text) / t}
+    return out
+
+
+@case
+def bench_process(b):
+    """
+    Generator.process: документ целиком (фон + все зоны) по числу зон и длине текста.
+    classic на порядок медленнее, поэтому для него только короткие тексты.
+    """
+    out = {}
+    matrix = [('fused', z, t) for z in (1, 4, 16) for t in ('short', 'long')]
+    if not b.quick: matrix += [('classic', z, 'short') for z in (1, 4)]
+    for mode, zones, name in matrix:
+        gen = Generator()
+        tpl = gen.compile(b.config(zones=zones, text=name, render_mode=mode, phys=PHYS_SWEEP))
+        t0 = time.perf_counter()
+        gen.process(b.bg_path, {'ID': 'bench'}, tpl)
+        cold = time.perf_counter() - t0
+        t = best_time(lambda: gen.process(b.bg_path, {'ID': 'bench'}, tpl), b.repeat)
+        glyphs = glyph_count(b.texts[name]) * zones
+        out[f"process/{mode}/{zones}z/{name}"] = {
+            'docs_per_sec': 1 / t, 'cold_docs_per_sec': 1 / cold, 'glyphs_per_sec': glyphs / t,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+    return out
+
+
+@case
+def bench_resolution(b):
+    """
+    Документ с кодированием JPEG в рабочем разрешении (max_dim из globals): доля от большей
+    стороны фона, 1.00 - родное разрешение. Фон уменьшается один раз, дальше берется из кэша.
+    """
+    out = {}
+    for frac in (1.0, 0.5, 1 / 3):
+        gen = Generator()
+        cfg = json.loads(b.config(zones=4, text='medium', render_mode='fused', phys=PHYS_SWEEP))
+        if frac < 1: cfg['globals']['max_dim'] = round(max(BG_SIZE) * frac)
+        tpl = gen.compile(json.dumps(cfg))
+        run = lambda: encode_image(gen.process(b.bg_path, {'ID': 'bench'}, tpl), OutputOptions())
+        t0 = time.perf_counter()
+        run()
+        cold = time.perf_counter() - t0
+        t = best_time(run, b.repeat)
+        out[f"resolution/{frac:.2f}"] = {'docs_per_sec': 1 / t, 'cold_docs_per_sec': 1 / cold,
+                                         'peak_rss_mb': peak_rss_mb()}
+    return out
+
+
+@case
+def bench_batch(b):
+    """Generator.batch целиком: чтение строк, рендер, кодирование JPEG и запись на диск"""
+    n = 8 if b.quick else 48
+    rows = b.rows(n)
+    tpl = json.loads(b.config(zones=4, render_mode='fused', phys=PHYS_SWEEP))
+    for z in tpl['zones']: z.update(sourceType='excel', content='text')
+    out = {}
+    cpus = os.cpu_count() or 1
+    for workers in sorted({1, max(1, cpus - 1)}):
+        folder = tempfile.mkdtemp(dir=b.tmp)
+        t0 = time.perf_counter()
+        Generator().batch([b.bg_path], rows, json.dumps(tpl), None, None, workers=workers,
+                          output=OutputOptions(), resume=False, folder=folder)
+        t = time.perf_counter() - t0
+        out[f"batch/{workers}w"] = {'docs_per_sec': n / t, 'peak_rss_mb': peak_rss_mb(),
+                                    'children_peak_rss_mb': peak_rss_mb(children=True)}
+    return out
+
+
+def compare(results, baseline, tolerance):
+    """Сравнение метрик *_per_sec с базой: печатает таблицу, возвращает список регрессий"""
+    regressions = []
+    print(f"{'замер':<40} {'метрика':<22} {'база':>10} {'сейчас':>10} {'x':>7}", file=sys.stderr)
+    for name, metrics in results.items():
+        base = baseline.get(name)
+        if not base: continue
+        for metric, value in metrics.items():
+            if not metric.endswith('_per_sec') or not base.get(metric): continue
+            ratio = value / base[metric]
+            flag = ""
+            if ratio < 1 - tolerance:
+                flag = "  РЕГРЕССИЯ"
+                regressions.append((name, metric, ratio))
+            print(f"{name:<40} {metric:<22} {base[metric]:>10.2f} {value:>10.2f} {ratio:>6.2f}x{flag}", file=sys.stderr)
+    return regressions
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks", description="Бенчмарки рендера документов")
+    p.add_argument("-o", "--output", help="куда сохранить JSON с результатами")
+    p.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    p.add_argument("--tolerance", type=float, default=0.10, help="допустимое замедление (доля, по умолчанию 0.10)")
+    p.add_argument("-r", "--repeat", type=int, default=3, help="прогонов на замер (берется лучший)")
+    p.add_argument("-k", "--filter", default="", help="только замеры, в имени которых есть подстрока")
+    p.add_argument("--quick", action="store_true", help="меньше данных и вариантов (для быстрой проверки)")
+    args = p.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        b = Bench(tmp, max(1, args.repeat), args.quick)
+        for fn in CASES:
+            if args.filter and args.filter not in fn.__name__: continue
+            print(f"{fn.__name__}...", file=sys.stderr)
+            for name, metrics in fn(b).items():
+                results[name] = {k: (round(v, 3) if isinstance(v, float) else v) for k, v in metrics.items()}
+
+    report = {
+        'meta': {
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'pillow': PIL.__version__,
+            'numpy': np.__version__,
+            'repeat': args.repeat,
+            'quick': args.quick,
+            'peak_rss_mb': peak_rss_mb(),
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f: f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('results', {})
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Регрессий: {len(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Пакетная генерация без интерфейса (для серверов без дисплея, webview не импортируется):
+
+    python -m core template.json table.xlsx backgrounds/ -o out -w 8 -f webp
+
+template.json - проект, сохраненный из интерфейса, или шаблон в формате getConfig().
+Таблицу и фон можно не указывать, если они записаны в проекте (excel, image).
+
+Сотни тысяч документов удобнее писать не отдельными файлами: --sink zip (tar, tiff:100, pdf:100,
+dirs:1000); где лежит документ каждой строки - в index.jsonl.
+
+Большой пакет на нескольких машинах: на каждой --shard i/N (с теми же шаблоном, таблицей и фонами),
+затем файлы собираются в одну папку и --merge проверяет, что документы есть для всех строк.
+"""
+import os
+import sys
+import json
+import argparse
+import threading
+from core.generator import Generator, OUTPUT_FOLDER
+from core.template import project_to_config, TemplateError
+from core.sources import open_rows
+from core.output import OutputOptions, FORMATS
+from core.progress import ProgressReporter
+from core.utils import list_backgrounds
+from core.shard import Shard, SHARD_MODES, merge_shards
+from core.sinks import SINKS
+from core.instrument import InstrumentOptions
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m core", description="Пакетная генерация документов без интерфейса")
+    p.add_argument("template", help="JSON проекта (Сохранить проект) или шаблона")
+    p.add_argument("rows", nargs="?", help="таблица: xlsx, xlsm, csv, parquet (по умолчанию - из проекта)")
+    p.add_argument("background", nargs="?", help="картинка фона или папка с фонами (по умолчанию - из проекта)")
+    p.add_argument("-o", "--output", default=OUTPUT_FOLDER, help=f"папка вывода (по умолчанию {OUTPUT_FOLDER})")
+    p.add_argument("-w", "--workers", type=int, default=max(1, (os.cpu_count() or 1) - 1),
+                   help="число процессов рендера (1 - в текущем процессе)")
+    p.add_argument("-f", "--format", default="jpg", choices=sorted(FORMATS), help="формат документов")
+    p.add_argument("-q", "--quality", type=int, default=None, help="качество JPEG/WebP")
+    p.add_argument("--writers", type=int, default=2, help="потоков кодирования и записи")
+    p.add_argument("--sink", default="files", metavar="ВИД[:N]",
+                   help=f"куда писать: {', '.join(SINKS)}; N - документов в контейнере (в подпапке для dirs)")
+    p.add_argument("--no-resume", action="store_true", help="перерисовать все, даже готовые документы")
+    p.add_argument("--quiet", action="store_true", help="не печатать прогресс")
+    p.add_argument("--shard", help="рендерить только часть i/N (например 2/8)")
+    p.add_argument("--shard-mode", default="hash", choices=SHARD_MODES,
+                   help="hash - по хешу ID строки, range - непрерывными диапазонами строк")
+    p.add_argument("--merge", action="store_true",
+                   help="не рендерить, а свести манифесты шардов в папке вывода и проверить покрытие")
+    p.add_argument("--timings", action="store_true",
+                   help="замеры по этапам рендера, отчет в <папка вывода>/timings.json")
+    p.add_argument("--profile-rows", metavar="A:B", help="cProfile для строк A..B-1 (включает --timings)")
+    p.add_argument("--profile-memory", action="store_true", help="вместе с --profile-rows: tracemalloc")
+    return p.parse_args(argv)
+
+
+def parse_row_range(spec):
+    """'10:20' -> (10, 20), '7' -> (7, 8)"""
+    if not spec: return None
+    start, _, stop = spec.partition(':')
+    start = int(start)
+    return (start, int(stop) if stop else start + 1)
+
+
+def print_progress(s):
+    line = f"{s['done']}/{s['total']}  {s['rate']:.1f} док/с"
+    if s['eta'] is not None: line += f"  осталось {s['eta']:.0f} с"
+    if s['errors']: line += f"  ошибок: {s['errors']}"
+    end = "\r" if s['running'] else "\n"
+    sys.stderr.write(line.ljust(60) + end)
+    sys.stderr.flush()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        with open(args.template, 'r', encoding='utf-8') as f:
+            project = json.load(f)
+        config = project_to_config(project)
+    except (OSError, ValueError, TemplateError) as e:
+        print(f"Шаблон {args.template}: {e}", file=sys.stderr)
+        return 2
+
+    image = project.get('image')
+    if isinstance(image, dict): image = image.get('path')
+    rows_path = args.rows or project.get('excel')
+    bg_path = args.background or image
+    if not rows_path or not bg_path:
+        print("Нужны таблица и фон (аргументами или в проекте)", file=sys.stderr)
+        return 2
+
+    bg_list = list_backgrounds(bg_path) if os.path.isdir(bg_path) else [bg_path]
+    if not bg_list:
+        print(f"В папке {bg_path} нет картинок", file=sys.stderr)
+        return 2
+    try:
+        rows = open_rows(rows_path)
+    except Exception as e:
+        print(f"Таблица {rows_path}: {e}", file=sys.stderr)
+        return 2
+
+    gen = Generator()
+    output = OutputOptions(fmt=args.format, quality=args.quality)
+    if args.merge:
+        report = merge_shards(gen, args.output, bg_list, rows, config, output, args.sink.partition(':')[0].lower())
+        print(f"Строк: {report['total']}, готово: {report['ok']}, нет: {len(report['missing'])}, "
+              f"устарели: {len(report['stale'])}", file=sys.stderr)
+        for name in (report['missing'] + report['stale'])[:20]: print(f"  {name}", file=sys.stderr)
+        return 0 if report['ok'] == report['total'] else 1
+    try:
+        shard = Shard.parse(args.shard, args.shard_mode) if args.shard else None
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    try:
+        profile_rows = parse_row_range(args.profile_rows)
+    except ValueError:
+        print(f"--profile-rows задается как A:B, а не {args.profile_rows!r}", file=sys.stderr)
+        return 2
+    instrument = None
+    if args.timings or profile_rows:
+        instrument = InstrumentOptions(profile_rows=profile_rows, memory=args.profile_memory)
+
+    progress = ProgressReporter(None if args.quiet else print_progress, max_rate=1)
+    # Рендер в отдельном потоке, чтобы Ctrl+C штатно останавливал пакет (манифест дописывается)
+    t = threading.Thread(target=gen.batch, args=(bg_list, rows, config, None, None), kwargs={
+        'workers': max(1, args.workers), 'output': output, 'writers': args.writers,
+        'resume': not args.no_resume, 'progress': progress, 'folder': args.output,
+        'shard': shard, 'instrument': instrument, 'sink': args.sink,
+    })
+    t.start()
+    try:
+        while t.is_alive(): t.join(0.2)
+    except KeyboardInterrupt:
+        print("\nОстановка...", file=sys.stderr)
+        gen.stop()
+        t.join()
+    plan = gen.plan_report
+    if plan and not args.quiet:
+        print(f"Оценка стоимости строк: {plan['predicted_seconds']} с, факт {plan['actual_seconds']} с, "
+              f"ошибка по строке {plan['mean_abs_error_pct']}%, корреляция {plan['correlation']}", file=sys.stderr)
+    return 1 if progress.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
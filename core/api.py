@@ -1,17 +1,21 @@
 import webview
-import pandas as pd
-import threading
 import json
 import os
-import glob # Добавили для поиска файлов
-from concurrent.futures import ThreadPoolExecutor
-from core.utils import image_to_base64, pillow_to_base64
 from core.generator import Generator
+from core.utils import list_backgrounds
+from core.sources import open_rows
+from core.preview import PreviewRenderer
+from core.samples import SampleRenderer
+from core.imageserver import ImageServer
+from core.progress import ProgressReporter
+from core.scheduler import Scheduler
 
 class Api:
     def __init__(self):
         self._window = None
-        self._gen = Generator()
+        self._gen = Generator() # Для превью и образцов; пакеты рендерит планировщик, каждый своим Generator
+        # Пакеты по очереди, превью и образцы - вне очереди (пакет на это время ждет), пауза и отмена
+        self.scheduler = Scheduler()
         
         # Теперь поддерживаем и одиночный путь, и список
         self.background_mode = 'single' # 'single' или 'folder'
@@ -19,8 +23,18 @@ class Api:
         self.bg_list = []               # Список всех картинок из папки
         
         self.excel_path = None
-        self.df = None
-        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.rows = None # RowSource: таблица читается потоково, здесь только заголовок
+        # Превью: уменьшенное разрешение, только последний запрос, кэш слоев зон
+        self.previewer = PreviewRenderer(self._gen)
+        # Картинки уходят в интерфейс бинарно по локальному URL, а не base64-строкой через мост
+        self.images = ImageServer()
+        # Образцы почерка: кэш готовых кадров, образцы всех шрифтов готовятся в фоне
+        self.samples = SampleRenderer(self._gen)
+        self.samples.prewarm(self._gen.get_fonts())
+        self._sample_base = None
+        self.progress = None # ProgressReporter текущего (или последнего) пакета
+        # Сколько процессов рендерят пакет (одно ядро оставляем под интерфейс)
+        self.workers = max(1, (os.cpu_count() or 1) - 1)
 
     def set_window(self, w): self._window = w
     def get_fonts_list(self): return self._gen.get_fonts()
@@ -30,15 +44,8 @@ class Api:
         r = self._window.create_file_dialog(webview.FOLDER_DIALOG)
         if r:
             folder = r[0]
-            # Ищем картинки (регистронезависимо по расширению - упрощенно)
-            exts = ['*.jpg', '*.jpeg', '*.png', '*.bmp']
-            files = []
-            for ext in exts:
-                files.extend(glob.glob(os.path.join(folder, ext)))
-                files.extend(glob.glob(os.path.join(folder, ext.upper())))
-            
-            # Убираем дубликаты и сортируем
-            files = sorted(list(set(files)))
+            # Ищем картинки (регистронезависимо по расширению)
+            files = list_backgrounds(folder)
             
             if not files:
                 return {"error": "В папке нет картинок!"}
@@ -51,7 +58,7 @@ class Api:
                 "mode": "folder",
                 "count": len(files),
                 "first_path": self.image_path,
-                "data": image_to_base64(self.image_path) # Отдаем фронту только одну
+                "data": self.images.file_url(self.image_path) # Отдаем фронту только одну
             }
         return None
 
@@ -65,7 +72,7 @@ class Api:
             return {
                 "mode": "single",
                 "path": r[0],
-                "data": image_to_base64(r[0])
+                "data": self.images.file_url(r[0])
             }
         return None
 
@@ -73,18 +80,19 @@ class Api:
     # (код их пропущу, он тот же)
     def pick_excel(self):
             # Используем константу webview.OPEN_DIALOG (она надежнее в разных версиях)
-            r = self._window.create_file_dialog(webview.FileDialog.OPEN, file_types=('Excel (*.xlsx;*.xls)',))
+            r = self._window.create_file_dialog(webview.FileDialog.OPEN, file_types=(
+                'Таблицы (*.xlsx;*.xlsm;*.csv;*.parquet)', 'Excel (*.xlsx;*.xlsm)', 'CSV (*.csv)', 'Parquet (*.parquet)'))
             
             if r:
                 path = r[0] if isinstance(r, tuple) else r
-                print(f"Выбран файл Excel: {path}")
+                print(f"Выбран файл таблицы: {path}")
                 try:
-                    # ВАЖНО: Добавили engine='openpyxl'
+                    # Читаем только заголовок; строки пойдут потоком уже во время генерации
                     self.excel_path = path
-                    self.df = pd.read_excel(path, dtype=str, engine='openpyxl').fillna("")
+                    self.rows = open_rows(path)
                     
-                    columns = list(self.df.columns)
-                    print(f"Excel загружен. Колонок: {len(columns)}")
+                    columns = list(self.rows.columns)
+                    print(f"Таблица открыта. Колонок: {len(columns)}")
                     return {"path": path, "columns": columns}
                 except Exception as e:
                     # ВАЖНО: Выводим реальную ошибку в консоль
@@ -119,7 +127,7 @@ class Api:
                         self.background_mode = 'single'
                         self.image_path = img_path
                         self.bg_list = [img_path]
-                        data['image'] = {"path": img_path, "data": image_to_base64(img_path)}
+                        data['image'] = {"path": img_path, "data": self.images.file_url(img_path)}
                     else:
                         data['image'] = {"path": img_path, "data": None}
                 return data
@@ -129,25 +137,56 @@ class Api:
     def get_preview(self, config_json):
         if not self.image_path: return {"error": "No Image"}
         # Превью всегда генерируем на self.image_path (первый файл)
-        f = self.pool.submit(self._gen.preview, self.image_path, config_json, self.df)
-        img = f.result()
-        if img: return {"data": pillow_to_base64(img)}
-        return {"error": "Gen failed"}
+        try:
+            with self.scheduler.interactive():
+                img = self.previewer.render(self.image_path, config_json, self.rows)
+        except Exception as e:
+            return {"error": str(e)}
+        # Пока рисовали, пришел более новый запрос - этот ответ интерфейсу уже не нужен
+        if img is None: return {"superseded": True}
+        return {"data": self.images.publish("preview", img)}
+
+    def get_sample_image(self, params_json):
+        """Образец строки для шрифта и параметров (globals шаблона) -> URL картинки"""
+        try:
+            params = json.loads(params_json) if isinstance(params_json, str) else dict(params_json)
+            with self.scheduler.interactive():
+                frame = self.samples.frame(params)
+        except Exception as e:
+            print(f"Err sample: {e}")
+            return None
+        # Поменялись параметры, кроме шрифта - в фоне перерисовываем образцы остальных шрифтов под них
+        base = {k: v for k, v in params.items() if k != 'font'}
+        if base != self._sample_base:
+            self._sample_base = base
+            self.samples.prewarm(self._gen.get_fonts(), base)
+        return self.images.publish_frame("sample", frame)
 
     # === ОБНОВЛЕННАЯ ГЕНЕРАЦИЯ ===
     def generate_docs(self, config_json):
-        if not self.bg_list or self.df is None: return
+        if not self.bg_list or self.rows is None: return
         
-        def prog(c, t): self._window.evaluate_js(f"updateProgress({c},{t})")
+        # evaluate_js - синхронный вызов в webview, поэтому шлем не на каждую строку, а с ограничением частоты
+        def prog(s): self._window.evaluate_js(f"updateProgress({s['done']},{s['total']},{json.dumps(s)})")
         def done(): self._window.evaluate_js("finishGeneration('Генерация завершена!')")
+        self.progress = ProgressReporter(prog)
         
-        # Передаем весь список фонов
-        t = threading.Thread(
-            target=self._gen.batch, 
-            args=(self.bg_list, self.df, config_json, prog, done)
-        )
-        t.start()
+        # Передаем весь список фонов; пакет встает в очередь планировщика
+        self.scheduler.submit(self.bg_list, self.rows, config_json, None, done,
+                              workers=self.workers, progress=self.progress)
+
+    def get_progress(self):
+        """Текущее состояние пакета: done, total, skipped, errors, rate (док/с), latency (с/строку), eta (с)"""
+        return self.progress.snapshot() if self.progress else None
 
     def stop_generation(self):
-        self._gen.stop()
-        return "Остановка..."
\ No newline at end of file
+        self.scheduler.cancel()
+        return "Остановка..."
+
+    def pause_generation(self):
+        self.scheduler.pause()
+        return "Пауза"
+
+    def resume_generation(self):
+        self.scheduler.resume()
+        return "Продолжение"
\ No newline at end of file
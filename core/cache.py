@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Простой LRU-кэш с ограничением по количеству элементов и (опционально) по байтам.
+    Потокобезопасный, считает попадания/промахи, чтобы можно было подобрать размер.
+    sizeof(value) - функция размера элемента в байтах, нужна только при max_bytes.
+    """
+
+    def __init__(self, max_items=1024, max_bytes=None, sizeof=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        # Элемент больше всего бюджета не кэшируем, иначе он вытеснит все остальное
+        if self.max_bytes is not None and size > self.max_bytes: return
+        with self._lock:
+            if key in self._data: self._drop(key)
+            self._data[key] = value
+            self._sizes[key] = size
+            self.bytes += size
+            while len(self._data) > self.max_items or (
+                    self.max_bytes is not None and self.bytes > self.max_bytes):
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        del self._data[key]
+        self.bytes -= self._sizes.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def __len__(self): return len(self._data)
+
+    def __contains__(self, key): return key in self._data
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "items": len(self._data),
+            "max_items": self.max_items,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
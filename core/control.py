@@ -0,0 +1,55 @@
+import time
+import multiprocessing as mp
+
+CHECK_POLL = 0.01  # Как часто задание на паузе проверяет, не пора ли продолжить (с)
+
+
+class JobCancelled(Exception):
+    """Задание отменено (cancel) - рендер прерывается на ближайшей проверке"""
+
+
+class JobControl:
+    """
+    Пауза, продолжение и отмена задания рендера. Генератор вызывает check() на каждой строке
+    текста и каждом символе, поэтому команды срабатывают сразу, а не между документами.
+    Флаги лежат в разделяемой памяти: тот же объект передается процессам пула (initargs),
+    и check() в них - одно чтение без блокировок.
+    gate - общий флаг планировщика (core.scheduler): пока он снят, задание ждет, как на паузе.
+    """
+
+    def __init__(self, gate=None):
+        self._flags = mp.RawArray('b', 2)  # [отмена, пауза]
+        self._gate = gate
+
+    def pause(self): self._flags[1] = 1
+
+    def resume(self): self._flags[1] = 0
+
+    def cancel(self): self._flags[0] = 1
+
+    @property
+    def cancelled(self): return bool(self._flags[0])
+
+    @property
+    def paused(self): return bool(self._flags[1])
+
+    def check(self):
+        """Отмена - JobCancelled; пауза (или занятый gate) - ждать здесь же"""
+        flags = self._flags
+        if flags[0]: raise JobCancelled()
+        gate = self._gate
+        while flags[1] or (gate is not None and not gate.value):
+            time.sleep(CHECK_POLL)
+            if flags[0]: raise JobCancelled()
+
+
+class NullControl:
+    """Без управления (превью, образцы, одиночный process): check() ничего не делает"""
+    cancelled = False
+    paused = False
+    def pause(self): pass
+    def resume(self): pass
+    def cancel(self): pass
+    def check(self): pass
+
+NULL_CONTROL = NullControl()
@@ -0,0 +1,170 @@
+import os
+import json
+import threading
+from PIL import ImageFont
+from core.cache import LRUCache
+from core.utils import get_external_path
+
+FONTS_FOLDER = get_external_path("fonts")
+FONT_EXTS = ('.ttf', '.otf')
+# Индекс покрытия и метрик лежит рядом с папкой шрифтов (внутри нее он выглядел бы как шрифт)
+FONT_INDEX_PATH = get_external_path("fonts_index.json")
+FONT_INDEX_VERSION = 1
+FONT_CACHE_SIZE = 256   # Открытых FreeTypeFont (шрифт x размер)
+PROBE_SIZE = 48
+METRICS_SIZE = 1000
+# Символы, покрытие которых проверяется заранее (без fontTools - пробным рендером):
+# латиница, кириллица, цифры и частая пунктуация. Остальные проверяются при первой встрече.
+REPERTOIRE = (''.join(chr(c) for c in range(0x21, 0x7F))
+              + ''.join(chr(c) for c in range(0x0400, 0x0460))
+              + '№«»—–…‘’“”„•°€₽§×')
+_MISSING = '\uffff'  # Не символ Unicode, его нет ни в одном шрифте - рисуется как .notdef
+
+
+def _probe(font, chars):
+    """
+    Покрытие пробным рендером: символ есть в шрифте, если его маска отличается от .notdef.
+    Если .notdef пустой, пустые символы тоже считаются отсутствующими (пробелы сюда не попадают).
+    """
+    def mask(c):
+        m = font.getmask(c)
+        return m.size, bytes(m)
+    notdef = mask(_MISSING)
+    return ''.join(c for c in chars if not c.isspace() and mask(c) != notdef)
+
+
+def _cmap_chars(path):
+    """Все символы из cmap через fontTools; None, если fontTools не установлен"""
+    try:
+        from fontTools.ttLib import TTFont
+    except ImportError:
+        return None
+    with TTFont(path, lazy=True, fontNumber=0) as tt:
+        return ''.join(sorted(chr(c) for c in tt.getBestCmap()))
+
+
+class FontRegistry:
+    """
+    Шрифты из папки fonts:
+    - ограниченный LRU открытых FreeTypeFont по (шрифт, размер);
+    - индекс покрытия символов и метрик для каждого файла, сохраняется в fonts_index.json
+      и пересчитывается только для новых и измененных (mtime, размер) файлов;
+    - covering(pool, char) - шрифты пула, в которых символ есть, чтобы не рисовать "тофу".
+    """
+
+    def __init__(self, folder=FONTS_FOLDER, index_path=FONT_INDEX_PATH, cache_size=FONT_CACHE_SIZE):
+        self.folder = folder
+        self.index_path = index_path
+        self.cache = LRUCache(max_items=cache_size)
+        self._lock = threading.Lock()
+        self._index = None     # имя -> запись (mtime, size, complete, chars, metrics)
+        self._chars = {}       # имя -> set символов
+        self._extra = {}       # имя -> {символ: есть ли} для символов вне заранее проверенных
+        self._covering = {}    # (пул, символ) -> шрифты пула с символом
+        self._failed = set()
+
+    def names(self):
+        if not os.path.exists(self.folder): return []
+        return [f for f in os.listdir(self.folder) if f.endswith(FONT_EXTS)]
+
+    def font(self, name, size):
+        """FreeTypeFont из кэша; None, если файл не открывается (ошибка печатается один раз)"""
+        key = (name, size)
+        font = self.cache.get(key)
+        if font is not None: return font
+        if name in self._failed: return None
+        try:
+            font = ImageFont.truetype(os.path.join(self.folder, name), size)
+        except (OSError, ValueError) as e:
+            self._failed.add(name)
+            print(f"Err font {name}: {e}")
+            return None
+        self.cache.put(key, font)
+        return font
+
+    # --- индекс ---
+
+    def index(self):
+        """Индекс всех шрифтов папки (при первом обращении - из файла, недостающее пересчитывается)"""
+        with self._lock:
+            if self._index is None: self._load()
+            return self._index
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('version') != FONT_INDEX_VERSION: saved = {}
+        except (OSError, ValueError):
+            saved = {}
+        old = saved.get('fonts', {})
+        index, changed = {}, False
+        for name in self.names():
+            st = os.stat(os.path.join(self.folder, name))
+            rec = old.get(name)
+            if not rec or rec.get('mtime') != st.st_mtime or rec.get('size') != st.st_size:
+                rec = self._scan(name, st)
+                changed = True
+            index[name] = rec
+        self._index = index
+        self._chars = {name: set(rec['chars']) for name, rec in index.items()}
+        if changed or len(old) != len(index): self._save()
+
+    def _scan(self, name, st):
+        path = os.path.join(self.folder, name)
+        rec = {'mtime': st.st_mtime, 'size': st.st_size, 'complete': False, 'chars': '', 'metrics': None}
+        try:
+            chars = _cmap_chars(path)
+            font = ImageFont.truetype(path, PROBE_SIZE)
+            if chars is None: chars = _probe(font, REPERTOIRE)
+            else: rec['complete'] = True
+            ascent, descent = ImageFont.truetype(path, METRICS_SIZE).getmetrics()
+            rec['chars'] = chars
+            # Метрики на кегль METRICS_SIZE: доли от размера шрифта
+            rec['metrics'] = {'ascent': ascent / METRICS_SIZE, 'descent': descent / METRICS_SIZE,
+                              'space': font.getlength(' ') / PROBE_SIZE}
+        except Exception as e:
+            # Битый файл остается в индексе пустым, чтобы не разбирать его на каждом запуске
+            print(f"Err font {name}: {e}")
+        return rec
+
+    def _save(self):
+        try:
+            tmp = self.index_path + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'version': FONT_INDEX_VERSION, 'fonts': self._index}, f, ensure_ascii=False)
+            os.replace(tmp, self.index_path)
+        except OSError as e:
+            # Папка программы может быть только для чтения - тогда индекс просто считается заново
+            print(f"Индекс шрифтов не сохранен: {e}")
+
+    def metrics(self, name):
+        rec = self.index().get(name)
+        return rec and rec['metrics']
+
+    # --- покрытие ---
+
+    def has_char(self, name, char):
+        index = self.index()
+        rec = index.get(name)
+        if rec is None: return True  # шрифт не из папки: проверить нечем, не отбрасываем
+        if char in self._chars[name]: return True
+        if rec['complete'] or char in REPERTOIRE: return False
+        extra = self._extra.setdefault(name, {})
+        if char not in extra:
+            font = self.font(name, PROBE_SIZE)
+            extra[char] = bool(font and _probe(font, char))
+        return extra[char]
+
+    def covering(self, pool, char):
+        """
+        Шрифты пула, в которых есть char. Если символ есть во всех (или ни в одном) -
+        сам пул, чтобы случайный выбор шрифта шел так же, как без фильтра.
+        """
+        key = (tuple(pool), char)
+        found = self._covering.get(key)
+        if found is None:
+            found = [f for f in pool if self.has_char(f, char)]
+            if not found or len(found) == len(pool): found = pool
+            self._covering[key] = found
+        return found
@@ -1,86 +1,232 @@
 import os
+import time
+import math
 import random
-import json
 import hashlib
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
-from core.utils import wrap_text, vary_color, resource_path, get_external_path
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from PIL import Image, ImageDraw, ImageFilter
+from core.utils import vary_color, resource_path
+from core.cache import LRUCache
+from core.template import CompiledTemplate, TemplateError, compile_template
+from core.layout import TextFitter
+from core.sources import iter_rows, count_rows, prefetch
+from core.output import OutputOptions, OutputStage, encode_image, doc_name
+from core.sinks import make_sink, INDEX_NAME
+from core.manifest import MANIFEST_NAME, Manifest, row_digest
+from core.shard import total_rows
+from core.instrument import NULL_TIMER, StageTimer, TIMINGS_NAME
+from core.ink import ink_params, apply_ink
+from core.progress import ProgressReporter
+from core.control import NULL_CONTROL, JobControl, JobCancelled
+from core.planner import CostPlanner
+from core.fonts import FontRegistry, FONTS_FOLDER
 
-FONTS_FOLDER = get_external_path("fonts")
 OUTPUT_FOLDER = "output"
+GLYPH_CACHE_SIZE = 4096 # Сколько масок глифов держим в памяти (на процесс)
+BG_CACHE_BYTES = 512 * 1024 * 1024 # Бюджет на декодированные фоны (на процесс)
+
+def _matmul(a, b):
+    """Произведение матриц 3x3 (списки списков)"""
+    return [[sum(a[i][k] * b[k][j] for k in range(3)) for j in range(3)] for i in range(3)]
+
+
+def _glyphs_bbox(glyphs, page_size):
+    """Прямоугольник (x0, y0, x1, y1), который занимают символы (с вылетами), обрезанный по странице"""
+    if not glyphs: return None
+    x0 = max(0, min(g['pos'][0] for g in glyphs))
+    y0 = max(0, min(g['pos'][1] for g in glyphs))
+    x1 = min(page_size[0], max(g['pos'][0] + g['orig_size'] for g in glyphs))
+    y1 = min(page_size[1], max(g['pos'][1] + g['orig_size'] for g in glyphs))
+    if x0 >= x1 or y0 >= y1: return None
+    return (x0, y0, x1, y1)
+
+
+def _group_regions(planned, page_size):
+    """
+    Символы зон -> [(прямоугольник, символы)]. Зоны с пересекающимися прямоугольниками
+    объединяются, а символы внутри группы идут в исходном порядке зон: там, где зоны
+    перекрываются, символы ложатся друг на друга так же, как на общем слое страницы.
+    """
+    groups = []  # [прямоугольник, номера зон]
+    for i, glyphs in enumerate(planned):
+        box = _glyphs_bbox(glyphs, page_size)
+        if box is None: continue
+        idx = [i]
+        # Сливаем со всеми пересекающимися группами, пока пересечения не кончатся
+        merged = True
+        while merged:
+            merged = False
+            for gr in groups:
+                b = gr[0]
+                if b[0] < box[2] and box[0] < b[2] and b[1] < box[3] and box[1] < b[3]:
+                    box = (min(b[0], box[0]), min(b[1], box[1]), max(b[2], box[2]), max(b[3], box[3]))
+                    idx += gr[1]
+                    groups.remove(gr)
+                    merged = True
+                    break
+        groups.append([box, idx])
+    return [(box, [g for i in sorted(idx) for g in planned[i]]) for box, idx in groups]
+
 
 class Generator:
-    def __init__(self):
-        self.font_cache = {}
-        self.is_running = False
+    def __init__(self, glyph_cache_size=GLYPH_CACHE_SIZE, bg_cache_bytes=BG_CACHE_BYTES):
+        # Шрифты: ограниченный кэш FreeTypeFont и индекс покрытия символов (fonts_index.json)
+        self.fonts = FontRegistry()
+        # Маски покрытия глифов: (шрифт, размер, символ) -> (маска L, смещение)
+        self.glyph_cache = LRUCache(glyph_cache_size)
+        # Декодированные RGBA фоны: (путь, mtime, размер файла) -> Image
+        self.bg_cache = LRUCache(max_items=256, max_bytes=bg_cache_bytes,
+                                 sizeof=lambda im: im.width * im.height * len(im.getbands()))
+        # Заголовки фонов: (путь, mtime, размер файла) -> (размер в пикселях, dpi или None)
+        self.bg_info = LRUCache(max_items=1024)
+        # Подбор размера текста под зону (с кэшем ширин слов и переносов)
+        self.fitter = TextFitter(self._get_cached_font)
+        # Замеры по этапам (core.instrument); по умолчанию выключены и почти ничего не стоят
+        self.timer = NULL_TIMER
+        self.timings = None # StageTimer последнего пакета с замерами
+        self.plan_report = None # Оценка стоимости строк против факта в последнем параллельном пакете
+        # Пауза/отмена текущего пакета (core.control); проверяется на каждой строке текста и символе
+        self.control = NULL_CONTROL
 
     def get_fonts(self):
-        if not os.path.exists(FONTS_FOLDER): return []
-        return [f for f in os.listdir(FONTS_FOLDER) if f.endswith(('.ttf', '.otf'))]
+        return self.fonts.names()
 
     def _get_cached_font(self, font_name, size):
-        key = f"{font_name}_{size}"
-        if key in self.font_cache: return self.font_cache[key]
-        try:
-            path = os.path.join(FONTS_FOLDER, font_name)
-            font = ImageFont.truetype(path, size)
-            self.font_cache[key] = font
-            return font
-        except: return None
+        font = self.fonts.cache.get((font_name, size))
+        if font is None:
+            with self.timer.stage('font_load'):
+                font = self.fonts.font(font_name, size)
+        return font
 
-    def _get_val(self, param):
+    def _load_background(self, img_path, scale=1.0):
+        """
+        Возвращает копию фона в RGBA (при scale < 1 - уменьшенную). Декодированные фоны кэшируются:
+        в режиме папки одни и те же сканы идут по кругу тысячи раз.
+        Ключ включает mtime и размер файла, чтобы замена файла на диске не давала старую картинку.
+        При уменьшении JPEG декодируется сразу в 1/2, 1/4 или 1/8 размера (draft, не меньше нужного),
+        остальное - resize с предварительным reduce.
+        """
+        st = os.stat(img_path)
+        key = (os.path.abspath(img_path), st.st_mtime_ns, st.st_size, scale)
+        img = self.bg_cache.get(key)
+        if img is None:
+            with self.timer.stage('background_decode'):
+                with Image.open(img_path) as src:
+                    size = (max(1, round(src.width * scale)), max(1, round(src.height * scale)))
+                    if scale < 1.0 and src.format == 'JPEG': src.draft(src.mode, size)
+                    img = src.convert("RGBA")
+                if img.size != size:
+                    img = img.resize(size, resample=Image.LANCZOS, reducing_gap=3.0)
+            self.bg_cache.put(key, img)
+        with self.timer.stage('background_copy'):
+            return img.copy()
+
+    def _background_info(self, img_path):
+        """(размер, dpi или None) фона - из заголовка файла, без декодирования"""
+        st = os.stat(img_path)
+        key = (os.path.abspath(img_path), st.st_mtime_ns, st.st_size)
+        info = self.bg_info.get(key)
+        if info is None:
+            with Image.open(img_path) as src:
+                info = (src.size, src.info.get('dpi'))
+            self.bg_info.put(key, info)
+        return info
+
+    def _fit_resolution(self, tpl, img_path):
+        """
+        Шаблон в рабочем разрешении для этого фона (target_dpi, max_dim) и множитель разрешения.
+        Без этих настроек - тот же шаблон и 1.0. Масштаб идет тем же путем, что у превью (scaled):
+        координаты и переносы в единицах шаблона, пиксели и физика умножаются на масштаб.
+        """
+        if not (tpl.target_dpi or tpl.max_dim): return tpl, 1.0
+        size, dpi = self._background_info(img_path)
+        factor = tpl.resolution_scale(size, dpi)
+        return (tpl.scaled(factor) if factor != 1.0 else tpl), factor
+
+    def _get_val(self, param, rng=random):
+        # Диапазоны в CompiledTemplate уже разобраны в (min, max)
+        if isinstance(param, tuple):
+            return rng.uniform(*param)
         if isinstance(param, dict) and 'min' in param and 'max' in param:
-            return random.uniform(param['min'], param['max'])
+            return rng.uniform(param['min'], param['max'])
         return float(param)
-
-    def _hex_to_rgb(self, hex_color):
-        hex_color = hex_color.lstrip('#')
-        return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
     
-    def _get_perspective_coefficients(self, src_points, dst_points):
+    def _get_perspective_coefficients(self, sizes, shifts):
         """
-        Вычисляет коэффициенты для перспективной трансформации.
-        src_points и dst_points - списки из 4 точек (x, y) каждая.
-        Возвращает кортеж из 8 коэффициентов для Image.PERSPECTIVE.
-        Использует numpy для решения системы уравнений.
+        Вычисляет коэффициенты Image.PERSPECTIVE сразу для пачки символов (одна строка целиком).
+        sizes - стороны квадратных холстов (N), shifts - случайные сдвиги углов (N x 8) в порядке
+        (верхний левый, верхний правый, нижний правый, нижний левый), по x и y.
+        Вместо МНК по системе 8x8 на каждый символ - закрытая формула квадрат -> четырехугольник
+        (Heckbert), посчитанная векторно. Возвращает массив N x 8.
         """
-        try:
-            import numpy as np
-            
-            # Создаем матрицу для системы уравнений
-            A = []
-            b = []
-            
-            for (x, y), (X, Y) in zip(src_points, dst_points):
-                A.append([x, y, 1, 0, 0, 0, -X*x, -X*y])
-                A.append([0, 0, 0, x, y, 1, -Y*x, -Y*y])
-                b.extend([X, Y])
-            
-            A = np.array(A, dtype=float)
-            b = np.array(b, dtype=float)
-            
-            # Решаем систему уравнений
-            coeffs = np.linalg.lstsq(A, b, rcond=None)[0]
-            
-            return tuple(coeffs)
-        except Exception as e:
-            # В случае ошибки возвращаем единичную трансформацию
-            return (1, 0, 0, 0, 1, 0, 0, 0)
-
-    def _pick_weighted_font(self, available_fonts, fonts_config):
-        """Выбирает один шрифт на основе весов"""
-        candidates = []
-        weights = []
-        for f in available_fonts:
-            w = fonts_config.get(f, 5) # Вес по умолчанию 5
-            if w > 0:
-                candidates.append(f)
-                weights.append(w)
-        
-        if not candidates:
-            return random.choice(available_fonts) if available_fonts else None
-        return random.choices(candidates, weights=weights, k=1)[0]
+        w = np.asarray(sizes, dtype=float)
+        d = np.asarray(shifts, dtype=float).reshape(-1, 4, 2)
+        # Целевые углы: углы квадрата + сдвиги
+        x0, y0 = d[:, 0, 0],     d[:, 0, 1]
+        x1, y1 = w + d[:, 1, 0], d[:, 1, 1]
+        x2, y2 = w + d[:, 2, 0], w + d[:, 2, 1]
+        x3, y3 = d[:, 3, 0],     w + d[:, 3, 1]
+
+        dx1, dx2, dx3 = x1 - x2, x3 - x2, x0 - x1 + x2 - x3
+        dy1, dy2, dy3 = y1 - y2, y3 - y2, y0 - y1 + y2 - y3
+        den = dx1 * dy2 - dx2 * dy1
+        # Вырожденный четырехугольник - оставляем символ без искажения
+        bad = np.abs(den) < 1e-12
+        den = np.where(bad, 1.0, den)
+        g = (dx3 * dy2 - dx2 * dy3) / den
+        h = (dx1 * dy3 - dx3 * dy1) / den
+
+        # Отображение единичного квадрата, затем переводим в координаты холста (делим на w)
+        coeffs = np.stack([
+            (x1 - x0 + g * x1) / w, (x3 - x0 + h * x3) / w, x0,
+            (y1 - y0 + g * y1) / w, (y3 - y0 + h * y3) / w, y0,
+            g / w, h / w,
+        ], axis=1)
+        coeffs[bad] = (1, 0, 0, 0, 1, 0, 0, 0)
+        return coeffs
+
+    def _get_glyph_mask(self, font_name, font, char):
+        """
+        Возвращает обрезанную по bbox маску покрытия символа (режим L) и ее смещение
+        относительно точки рисования. Растеризация TrueType дорогая, поэтому маски кэшируются.
+        """
+        key = (font_name, font.size, char)
+        cached = self.glyph_cache.get(key)
+        if cached is not None: return cached
+
+        with self.timer.stage('glyph_raster'):
+            x0, y0, x1, y1 = ImageDraw.Draw(Image.new('L', (1, 1))).textbbox((0, 0), char, font=font)
+            mask = Image.new('L', (max(1, x1 - x0), max(1, y1 - y0)), 0)
+            ImageDraw.Draw(mask).text((-x0, -y0), char, font=font, fill=255)
+        cached = (mask, (x0, y0))
+        self.glyph_cache.put(key, cached)
+        return cached
 
-    def _draw_line(self, img, text, font_pool, size, x, y, phys, base_color):
+    def _colorize_mask(self, mask, color, alpha):
+        """
+        Превращает маску покрытия в RGBA так же, как ImageDraw.text рисует на прозрачном холсте:
+        цвет там, где маска > 0 (иначе белый), альфа = маска * alpha (с округлением Pillow).
+        """
+        alpha_lut = []
+        for m in range(256):
+            tmp = alpha * m + 128
+            alpha_lut.append(((tmp >> 8) + tmp) >> 8)
+        channels = [mask.point([255] + [c] * 255) for c in color]
+        return Image.merge('RGBA', (*channels, mask.point(alpha_lut)))
+
+    def _pick_weighted_font(self, tpl, rng=random):
+        """Выбирает один шрифт на основе весов (кандидаты и веса уже посчитаны в шаблоне)"""
+        if not tpl.weighted_fonts:
+            return rng.choice(tpl.fonts) if tpl.fonts else None
+        return rng.choices(tpl.weighted_fonts, weights=tpl.font_weights, k=1)[0]
+
+    def _plan_line(self, text, font_pool, size, x, y, phys, base_color, rng):
+        """
+        Первый проход по строке: все случайные параметры символов и их позиции.
+        Порядок вызовов rng совпадает с прежним посимвольным рендером,
+        поэтому результат для конкретного ID не меняется.
+        """
         shake = phys['shakiness']
         opacity_val = phys['opacity'] # Новый параметр (0-10)
         slant = phys['slant']
@@ -89,17 +235,22 @@ class Generator:
         height_var = phys.get('height_variation', 0)  # Вариация высоты (0-100%)
         width_var = phys.get('width_variation', 0)    # Вариация ширины (0-100%)
         distortion = phys.get('distortion', 0)        # Деформация букв (0-100)
+        # Масштаб рендера относительно шаблона (превью, целевое разрешение).
+        # Пиксельные сдвиги умножаем уже после вызовов rng, чтобы случайная последовательность не менялась
+        px_scale = phys.get('scale', 1.0)
         
         cursor_x = x
         scale_factor = 3 
+        glyphs = []
         
         for char in text:
             if char == ' ':
                 temp_f = self._get_cached_font(font_pool[0], size)
-                cursor_x += temp_f.getlength(' ') + random.randint(0, int(max_kern/2+1))
+                cursor_x += temp_f.getlength(' ') + rng.randint(0, int(max_kern/2+1)) * px_scale
                 continue
             
-            current_font_name = random.choice(font_pool)
+            # Только шрифты, в которых символ есть (если он есть во всех - пул тот же, выбор не меняется)
+            current_font_name = rng.choice(self.fonts.covering(font_pool, char))
             font = self._get_cached_font(current_font_name, size)
             
             # === РАСЧЕТ ПРОЗРАЧНОСТИ ===
@@ -109,147 +260,253 @@ class Generator:
             alpha_base = 30 + (opacity_val * 22.5) 
             
             # Добавляем рандом, чтобы буквы немного "мерцали" по плотности
-            alpha = int(max(10, min(255, alpha_base + random.randint(-15, 15))))
+            alpha = int(max(10, min(255, alpha_base + rng.randint(-15, 15))))
             
-            current_color = vary_color(base_color, variance=15)
+            current_color = vary_color(base_color, variance=15, rng=rng)
             
             # Вариация размера символа для реалистичности
             # height_var и width_var в процентах (0-100)
             # Генерируем случайные множители от (1 - var/100) до (1 + var/100)
-            h_factor = 1.0 + random.uniform(-height_var/100, height_var/100)
-            w_factor = 1.0 + random.uniform(-width_var/100, width_var/100)
+            h_factor = 1.0 + rng.uniform(-height_var/100, height_var/100)
+            w_factor = 1.0 + rng.uniform(-width_var/100, width_var/100)
             
             # Подготовка
             orig_size = int(size * 2.5)
             c_size = orig_size * scale_factor
-            big_font = self._get_cached_font(current_font_name, size * scale_factor)
-            if not big_font: big_font = font
-
             # Создаем холст побольше, чтобы вместить варьирующийся размер
             canvas_size = int(c_size * max(h_factor, w_factor) * 1.2)
-            char_img = Image.new('RGBA', (canvas_size, canvas_size), (255,255,255,0))
-            d = ImageDraw.Draw(char_img)
-            
-            # === НИКАКОЙ ОБВОДКИ ===
-            # stroke_width убираем (ставим 0), чтобы шрифт был естественным
-            d.text((canvas_size//4, canvas_size//4), char, font=big_font, fill=(*current_color, alpha), stroke_width=0)
-            
-            # Применяем вариацию высоты и ширины через масштабирование
-            if h_factor != 1.0 or w_factor != 1.0:
-                new_w = int(canvas_size * w_factor)
-                new_h = int(canvas_size * h_factor)
-                char_img = char_img.resize((new_w, new_h), resample=Image.LANCZOS)
-                # Обрезаем/дополняем до квадрата для дальнейших трансформаций
-                final_canvas = Image.new('RGBA', (canvas_size, canvas_size), (255,255,255,0))
-                offset_x = (canvas_size - new_w) // 2
-                offset_y = (canvas_size - new_h) // 2
-                final_canvas.paste(char_img, (offset_x, offset_y))
-                char_img = final_canvas
-            
+
             # Деформация букв (перспективное искажение)
+            # Здесь только случайные сдвиги углов (верхний левый, верхний правый,
+            # нижний правый, нижний левый); коэффициенты считаются разом на всю строку
+            shifts = None
             if distortion > 0:
-                # Применяем случайную перспективную деформацию
                 # distortion в процентах (0-100) определяет максимальный сдвиг углов
                 max_shift = (distortion / 100.0) * canvas_size * 0.15  # Максимум 15% от размера
-                
-                # Исходные углы квадрата
-                width = canvas_size
-                height = canvas_size
-                
-                # Целевые углы с небольшими случайными сдвигами
-                coeffs = self._get_perspective_coefficients(
-                    # Исходные 4 угла (верхний левый, верхний правый, нижний правый, нижний левый)
-                    [(0, 0), (width, 0), (width, height), (0, height)],
-                    # Целевые углы со случайными сдвигами
-                    [
-                        (random.uniform(-max_shift, max_shift), random.uniform(-max_shift, max_shift)),
-                        (width + random.uniform(-max_shift, max_shift), random.uniform(-max_shift, max_shift)),
-                        (width + random.uniform(-max_shift, max_shift), height + random.uniform(-max_shift, max_shift)),
-                        (random.uniform(-max_shift, max_shift), height + random.uniform(-max_shift, max_shift))
-                    ]
-                )
-                char_img = char_img.transform((canvas_size, canvas_size), Image.PERSPECTIVE, coeffs, resample=Image.BICUBIC)
-            
+                shifts = [rng.uniform(-max_shift, max_shift) for _ in range(8)]
+
             # Blur (теперь зависит только от слайдера Blur)
-            if blur_val > 0:
-                # Мягкий блюр
-                radius = (blur_val / 3.0) + random.uniform(0, 0.1)
-                char_img = char_img.filter(ImageFilter.GaussianBlur(radius=radius))
+            # Мягкий блюр
+            radius = ((blur_val / 3.0) + rng.uniform(0, 0.1)) * px_scale if blur_val > 0 else 0
 
             # Slant
-            shear_val = slant * 0.1 + random.uniform(-0.02, 0.02)
-            if abs(shear_val) > 0.01:
-                char_img = char_img.transform((canvas_size, canvas_size), Image.AFFINE, (1, -shear_val, 0, 0, 1, 0), resample=Image.BICUBIC)
+            shear_val = slant * 0.1 + rng.uniform(-0.02, 0.02)
+            if abs(shear_val) <= 0.01: shear_val = 0
 
             # Rotation
-            ang = random.uniform(-shake * 1.2, shake * 1.2)
-            char_img = char_img.rotate(ang, resample=Image.BICUBIC)
-            
-            # Resize до финального размера
-            char_img = char_img.resize((orig_size, orig_size), resample=Image.LANCZOS)
+            ang = rng.uniform(-shake * 1.2, shake * 1.2)
             
             # Jitter
-            y_off = random.uniform(-shake * 0.6, shake * 0.6)
-            
-            img.paste(char_img, (int(cursor_x - orig_size//4), int(y + y_off - orig_size//4)), char_img)
+            y_off = rng.uniform(-shake * 0.6, shake * 0.6) * px_scale
+
+            glyphs.append({
+                'char': char, 'font_name': current_font_name, 'font': font, 'size': size,
+                'color': current_color, 'alpha': alpha,
+                'w_factor': w_factor, 'h_factor': h_factor,
+                'orig_size': orig_size, 'canvas_size': canvas_size,
+                'shifts': shifts, 'coeffs': None,
+                'radius': radius, 'shear': shear_val, 'angle': ang,
+                'pos': (int(cursor_x - orig_size//4), int(y + y_off - orig_size//4)),
+            })
             
             # Kerning + Overlap
             char_w = font.getlength(char)
             overlap = char_w * 0.08
-            cursor_x += (char_w - overlap) + random.randint(-int(max_kern/2), max_kern)
+            cursor_x += (char_w - overlap) + rng.randint(-int(max_kern/2), max_kern) * px_scale
+        return glyphs
+
+    def _layout_line(self, text, font_pool, size, x, y, phys, base_color, rng):
+        """Символы строки с позициями и всеми параметрами (включая перспективу), без рисования"""
+        timer = self.timer
+        self.control.check()
+        with timer.stage('plan'):
+            glyphs = self._plan_line(text, font_pool, size, x, y, phys, base_color, rng)
+        timer.count('glyphs', len(glyphs))
+
+        # Перспектива для всех искаженных символов строки - одним вызовом numpy
+        distorted = [g for g in glyphs if g['shifts'] is not None]
+        if distorted:
+            with timer.stage('perspective_coeffs'):
+                coeffs = self._get_perspective_coefficients(
+                    [g['canvas_size'] for g in distorted], [g['shifts'] for g in distorted])
+                for g, c in zip(distorted, coeffs): g['coeffs'] = tuple(c.tolist())
+        return glyphs
+
+    def _render_glyphs(self, img, glyphs, phys, origin=(0, 0)):
+        """Рисует спланированные символы на img; origin - где на странице левый верхний угол img"""
+        timer = self.timer
+        ox, oy = origin
+        # 'classic' - цепочка ресэмплов на холсте x3, 'fused' - одна трансформация на символ
+        render = self._render_glyph_fused if phys.get('render_mode') == 'fused' else self._render_glyph_chain
+        # При эффектах чернил на слой символы не размываем по одному - блюр будет один на весь слой
+        blur = phys.get('ink_effects') != 'layer'
+        check = self.control.check
+        for g in glyphs:
+            check()
+            char_img = render(g, blur)
+            px, py = g['pos']
+            with timer.stage('paste'):
+                img.paste(char_img, (px - ox, py - oy), char_img)
+
+    def _draw_line(self, img, text, font_pool, size, x, y, phys, base_color, rng):
+        glyphs = self._layout_line(text, font_pool, size, x, y, phys, base_color, rng)
+        self._render_glyphs(img, glyphs, phys)
+
+    def _apply_ink(self, layer, doc, origin):
+        """Эффекты чернил на слой (ink_effects='layer'), origin - положение слоя на странице"""
+        radius, density = ink_params(doc['phys'])
+        with self.timer.stage('ink'):
+            return apply_ink(layer, radius, density, doc['seed'], origin, doc['phys'].get('scale', 1.0))
+
+    def _render_glyph_chain(self, g, blur=True):
+        """Классический рендер: символ на холсте x3 и цепочка ресэмплов (resize, перспектива, наклон, поворот, resize)"""
+        timer = self.timer
+        canvas_size = g['canvas_size']
+        big_font = self._get_cached_font(g['font_name'], g['size'] * 3)
+        if not big_font: big_font = g['font']
 
-    def _fit_and_draw(self, img, text, font_pool, max_size, zone, phys, color):
-        w_box = zone['width']
-        h_box = zone['height']
-        x_start = zone['x']
-        y_start = zone['y']
+        # === НИКАКОЙ ОБВОДКИ ===
+        # Маску символа берем из кэша и кладем в ту же точку, куда раньше рисовали текст
+        glyph_mask, (gx, gy) = self._get_glyph_mask(g['font_name'], big_font, g['char'])
+        with timer.stage('colorize'):
+            coverage = Image.new('L', (canvas_size, canvas_size), 0)
+            coverage.paste(glyph_mask, (canvas_size//4 + gx, canvas_size//4 + gy))
+            char_img = self._colorize_mask(coverage, g['color'], g['alpha'])
         
-        line_spacing_factor = 1.0 + (random.uniform(-0.02, 0.02))
+        # Применяем вариацию высоты и ширины через масштабирование
+        h_factor, w_factor = g['h_factor'], g['w_factor']
+        if h_factor != 1.0 or w_factor != 1.0:
+            with timer.stage('size_variation'):
+                new_w = int(canvas_size * w_factor)
+                new_h = int(canvas_size * h_factor)
+                char_img = char_img.resize((new_w, new_h), resample=Image.LANCZOS)
+                # Обрезаем/дополняем до квадрата для дальнейших трансформаций
+                final_canvas = Image.new('RGBA', (canvas_size, canvas_size), (255,255,255,0))
+                offset_x = (canvas_size - new_w) // 2
+                offset_y = (canvas_size - new_h) // 2
+                final_canvas.paste(char_img, (offset_x, offset_y))
+                char_img = final_canvas
+        
+        if g['coeffs'] is not None:
+            with timer.stage('perspective'):
+                char_img = char_img.transform((canvas_size, canvas_size), Image.PERSPECTIVE, g['coeffs'], resample=Image.BICUBIC)
+        
+        if blur and g['radius'] > 0:
+            with timer.stage('blur'):
+                char_img = char_img.filter(ImageFilter.GaussianBlur(radius=g['radius']))
+
+        if g['shear']:
+            with timer.stage('shear'):
+                char_img = char_img.transform((canvas_size, canvas_size), Image.AFFINE, (1, -g['shear'], 0, 0, 1, 0), resample=Image.BICUBIC)
 
-        current_size = max_size
-        min_size = 12
-        final_lines = []
-        text_pixel_height = 0
+        with timer.stage('rotate'):
+            char_img = char_img.rotate(g['angle'], resample=Image.BICUBIC)
         
-        # Для расчета влезания текста используем первый шрифт из пула
-        while max_size >= min_size:
-            font = self._get_cached_font(font_pool[0], max_size)
-            if not font: break
-            lines = wrap_text(text, font, w_box)
-            if not lines: break
-            
-            ascent, descent = font.getmetrics()
-            line_height = (ascent + descent) * line_spacing_factor
-            total_h = len(lines) * line_height
-            
-            if total_h <= h_box:
-                final_lines = lines
-                text_pixel_height = total_h
-                break
-            max_size -= 2
+        # Resize до финального размера
+        with timer.stage('downscale'):
+            return char_img.resize((g['orig_size'], g['orig_size']), resample=Image.LANCZOS)
+
+    def _render_glyph_fused(self, g, blur=True):
+        """
+        Быстрый рендер: масштаб, перспектива, наклон, поворот и уменьшение собраны
+        в одну проективную матрицу, поэтому ресэмплинг один и сразу в итоговый размер.
+        Геометрия повторяет классическую цепочку (_render_glyph_chain).
+        Маска берется в размере шрифта size, без холста x3.
+        """
+        glyph_mask, (gx, gy) = self._get_glyph_mask(g['font_name'], g['font'], g['char'])
+        cs = g['canvas_size']
+        orig_size = g['orig_size']
+
+        # Все матрицы - обратные отображения (координаты результата -> координаты источника),
+        # как их понимает Image.transform. Идем от результата к источнику.
+        # 1. Уменьшение холста cs -> orig_size
+        k = cs / orig_size
+        m = [[k, 0, 0], [0, k, 0], [0, 0, 1]]
+        # 2. Поворот вокруг центра (как в Image.rotate)
+        rad = -math.radians(g['angle'])
+        cos_a, sin_a = math.cos(rad), math.sin(rad)
+        c = cs / 2.0
+        m = _matmul([[cos_a, sin_a, c - cos_a * c - sin_a * c],
+                     [-sin_a, cos_a, c + sin_a * c - cos_a * c],
+                     [0, 0, 1]], m)
+        # 3. Наклон
+        if g['shear']:
+            m = _matmul([[1, -g['shear'], 0], [0, 1, 0], [0, 0, 1]], m)
+        # 4. Перспектива
+        if g['coeffs'] is not None:
+            a, b, cc, d, e, f, pg, ph = g['coeffs']
+            m = _matmul([[a, b, cc], [d, e, f], [pg, ph, 1]], m)
+        # 5. Вариация ширины/высоты (растянутый холст вставлен по центру)
+        new_w = int(cs * g['w_factor'])
+        new_h = int(cs * g['h_factor'])
+        m = _matmul([[cs / new_w, 0, -((cs - new_w) // 2) * cs / new_w],
+                     [0, cs / new_h, -((cs - new_h) // 2) * cs / new_h],
+                     [0, 0, 1]], m)
+        # 6. Холст x3 -> маска символа в размере size (ее левый верхний угол в (cs//4)/3 + смещение)
+        s = 1.0 / 3
+        m = _matmul([[s, 0, -(cs // 4) * s - gx], [0, s, -(cs // 4) * s - gy], [0, 0, 1]], m)
+
+        norm = m[2][2]
+        data = tuple(v / norm for v in (m[0][0], m[0][1], m[0][2], m[1][0], m[1][1], m[1][2], m[2][0], m[2][1]))
+        timer = self.timer
+        with timer.stage('transform'):
+            out = glyph_mask.transform((orig_size, orig_size), Image.PERSPECTIVE, data, resample=Image.BICUBIC)
+
+        if blur and g['radius'] > 0:
+            with timer.stage('blur'):
+                out = out.filter(ImageFilter.GaussianBlur(radius=g['radius'] / k))
+        with timer.stage('colorize'):
+            return self._colorize_mask(out, g['color'], g['alpha'])
+
+    def _fit_and_draw(self, img, text, font_pool, max_size, zone, phys, color, rng):
+        glyphs = self._fit_and_plan(text, font_pool, max_size, zone, phys, color, rng)
+        self._render_glyphs(img, glyphs, phys)
+
+    def _fit_and_plan(self, text, font_pool, max_size, zone, phys, color, rng):
+        """Подбирает размер текста под зону и планирует все его строки. Возвращает список символов"""
+        w_box = zone.width
+        h_box = zone.height
+        x_start = zone.x
+        y_start = zone.y
         
-        if not final_lines: return
+        line_spacing_factor = 1.0 + (rng.uniform(-0.02, 0.02))
+
+        # Для расчета влезания текста используем первый шрифт из пула.
+        # Подбор идет в единицах шаблона, поэтому переносы строк не зависят от масштаба рендера
+        with self.timer.stage('fit'):
+            fit = self.fitter.fit(text, font_pool[0], max_size, w_box, h_box, line_spacing_factor)
+        if not fit: return []
+        size, final_lines, line_height = fit
+        text_pixel_height = len(final_lines) * line_height
 
         available_space = h_box - text_pixel_height
         y_offset = available_space / 2
+
+        # Переводим в пиксели рендера
+        px_scale = phys.get('scale', 1.0)
+        draw_size = max(1, int(round(size * px_scale)))
+        x_start *= px_scale
+        curr_y = (y_start + y_offset) * px_scale
+        line_height *= px_scale
         
-        ascent, descent = self._get_cached_font(font_pool[0], max_size).getmetrics()
-        line_height = (ascent + descent) * line_spacing_factor
-        curr_y = y_start + y_offset
-        
+        glyphs = []
         for line in final_lines:
-            self._draw_line(img, line, font_pool, max_size, x_start, curr_y, phys, color)
+            glyphs += self._layout_line(line, font_pool, draw_size, x_start, curr_y, phys, color, rng)
             curr_y += line_height
+        return glyphs
 
 
-    def _set_seed(self, row, index, global_seed):
-        # 1. Ищем ID в Excel
-        id_val = None
+    def _row_id(self, row):
+        """Значение колонки ID (без учета регистра и пробелов в имени) или None"""
         if isinstance(row, dict): # Защита
             for k in row.keys():
                 if str(k).strip().lower() == 'id':
-                    id_val = row[k]
-                    break
+                    return row[k]
+        return None
+
+    def _seed_key(self, row, index, global_seed):
+        # 1. Ищем ID в Excel
+        id_val = self._row_id(row)
         
         # 2. Формируем строку для хеша
         # Комбинируем: "ЗНАЧЕНИЕ_ID" + "_" + "КЛЮЧ_ПРОЕКТА"
@@ -258,144 +515,355 @@ class Generator:
             seed_str = f"{id_val}_{global_seed}"
         else:
             seed_str = f"row_{index}_{global_seed}"
-            
+        return seed_str
+
+    def _make_rng(self, row, index, global_seed):
+        """
+        Создает отдельный генератор случайных чисел для строки.
+        Глобальный random не трогаем: так строки можно рендерить
+        параллельно в разных потоках/процессах с тем же результатом.
+        """
+        return random.Random(self._row_seed(row, index, global_seed))
+
+    def _row_seed(self, row, index, global_seed):
+        """Целое зерно строки (md5 от seed key)"""
+        seed_str = self._seed_key(row, index, global_seed)
         hash_obj = hashlib.md5(seed_str.encode('utf-8'))
-        seed_int = int(hash_obj.hexdigest(), 16) % (2**32)
-        random.seed(seed_int)
+        return int(hash_obj.hexdigest(), 16) % (2**32)
 
 
+    def compile(self, config_json):
+        """Разбирает шаблон один раз на пакет (см. core.template)"""
+        with self.timer.stage('compile'):
+            return compile_template(config_json, self.get_fonts())
+
     # Обновили сигнатуру: добавили row_index=0
-    def process(self, img_path, df_row, config_json, row_index=0):
+    # template - JSON строка шаблона или уже скомпилированный CompiledTemplate
+    def process(self, img_path, df_row, template, row_index=0):
+        tpl = template if isinstance(template, CompiledTemplate) else self.compile(template)
         try: 
-            base_img = Image.open(img_path).convert("RGBA")
-            txt_layer = Image.new('RGBA', base_img.size, (255,255,255,0))
+            tpl, factor = self._fit_resolution(tpl, img_path)
+            base_img = self._load_background(img_path, tpl.scale)
         except: return None
+        if factor != 1.0:
+            # Разрешение уменьшенного документа - в его метаданные (encode_image запишет его в файл)
+            dpi = base_img.info.get('dpi')
+            if not (dpi and dpi[0] > 1) and tpl.source_dpi: dpi = (tpl.source_dpi, tpl.source_dpi)
+            if dpi: base_img.info['dpi'] = (dpi[0] * factor, dpi[1] * factor)
+            base_img.info['render_scale'] = factor
 
-        cfg = json.loads(config_json)
-        glo = cfg['globals']
-        zones = cfg['zones']
-        
-        # Получаем ключ проекта (seed), если нет - 'default'
-        project_seed = glo.get('seed', 'default')
+        if not tpl.fonts: return base_img
 
-        # === УСТАНАВЛИВАЕМ SEED С УЧЕТОМ КЛЮЧА ===
-        self._set_seed(df_row, row_index, project_seed)
-        # ==========================================
-        
-        avail = self.get_fonts()
-        if not avail: return base_img
+        # Сначала планируем все зоны (весь rng тратится здесь, в прежнем порядке), потом рисуем.
+        # Слой текста не на всю страницу, а только на прямоугольник символов зоны;
+        # пересекающиеся зоны рисуются в общий слой, поэтому результат тот же, что со слоем на всю страницу
+        doc = self._begin_doc(tpl, df_row, row_index)
+        planned = [self._plan_zone(z, doc, df_row) for z in tpl.zones]
+        for (x0, y0, x1, y1), glyphs in _group_regions(planned, base_img.size):
+            with self.timer.stage('layer_alloc'):
+                layer = Image.new('RGBA', (x1 - x0, y1 - y0), (255,255,255,0))
+            self._render_glyphs(layer, glyphs, doc['phys'], (x0, y0))
+            if tpl.ink_effects == 'layer': layer = self._apply_ink(layer, doc, (x0, y0))
+            with self.timer.stage('composite'):
+                base_img.alpha_composite(layer, (x0, y0))
+        return base_img
 
-        fonts_cfg = glo.get('fonts_config', {})
+    def _begin_doc(self, tpl, df_row, row_index):
+        """
+        Параметры документа, общие для всех зон: rng строки, физика, цвет, размер и шрифт документа.
+        Дальше зоны рисуются по порядку тем же rng.
+        """
+        # === СВОЙ RNG ДЛЯ СТРОКИ С УЧЕТОМ КЛЮЧА ПРОЕКТА (seed) ===
+        seed = self._row_seed(df_row, row_index, tpl.seed)
+        rng = random.Random(seed)
+        # ==========================================
         
-        # Теперь все random.choice и random.uniform ниже будут давать 
+        # Теперь все rng.choice и rng.uniform ниже будут давать 
         # ОДИНАКОВЫЙ результат для одного и того же seed_str
 
         doc_font_name = None 
-        active_pool = [f for f, w in fonts_cfg.items() if w > 0]
-        if not active_pool: active_pool = [avail[0]]
-
-        if glo['font'] == 'random_per_doc':
-            doc_font_name = self._pick_weighted_font(avail, fonts_cfg)
-        elif glo['font'] != 'random' and glo['font'] in avail:
-            doc_font_name = glo['font']
+        if tpl.font_mode == 'random_per_doc':
+            doc_font_name = self._pick_weighted_font(tpl, rng)
 
         # Параметры документа (теперь они жестко привязаны к ID)
-        doc_base_size = int(self._get_val(glo.get('size', 20)))
+        doc_base_size = int(self._get_val(tpl.size, rng))
         
-        doc_phys = {
-            'shakiness': self._get_val(glo.get('shakiness', 0)),
-            'opacity':   self._get_val(glo.get('opacity', 8)),
-            'kerning':   self._get_val(glo.get('kerning', 0)),
-            'slant':     self._get_val(glo.get('slant', 0)),
-            'blur':      self._get_val(glo.get('blur', 0)),
-            'height_variation': self._get_val(glo.get('height_variation', 0)),
-            'width_variation':  self._get_val(glo.get('width_variation', 0)),
-            'distortion': self._get_val(glo.get('distortion', 0))
+        doc_phys = {name: self._get_val(param, rng) for name, param in tpl.phys}
+        # 'classic' - цепочка ресэмплов на холсте x3, 'fused' - одна трансформация на символ
+        doc_phys['render_mode'] = tpl.render_mode
+        # Масштаб рендера относительно координат шаблона
+        doc_phys['scale'] = tpl.scale
+        doc_phys['ink_effects'] = tpl.ink_effects
+
+        c_var = int(self._get_val(tpl.color_var, rng))
+        r, g, b = tpl.base_rgb
+        r = max(0, min(255, r + rng.randint(-c_var, c_var)))
+        g = max(0, min(255, g + rng.randint(-c_var, c_var)))
+        b = max(0, min(255, b + rng.randint(-c_var, c_var)))
+
+        return {
+            'rng': rng,
+            'seed': seed,
+            'phys': doc_phys,
+            'color': (r, g, b),
+            'base_size': doc_base_size,
+            'font_pool': [doc_font_name or tpl.active_pool[0]],
         }
 
-        base_rgb = self._hex_to_rgb(glo['color'])
-        c_var = int(self._get_val(glo.get('color_var', 0)))
-        r, g, b = base_rgb
-        r = max(0, min(255, r + random.randint(-c_var, c_var)))
-        g = max(0, min(255, g + random.randint(-c_var, c_var)))
-        b = max(0, min(255, b + random.randint(-c_var, c_var)))
-        doc_color = (r, g, b)
-
-        for z in zones:
-            zone_font_pool = []
-            if z.get('font') and z['font'] in avail:
-                zone_font_pool = [z['font']]
-            else:
-                if glo['font'] == 'random':
-                    zone_font_pool = active_pool 
-                elif glo['font'] == 'random_per_doc':
-                    zone_font_pool = [doc_font_name] if doc_font_name else [active_pool[0]]
-                else:
-                    main_f = glo['font'] if glo['font'] in avail else avail[0]
-                    zone_font_pool = [main_f]
-            
-            size = z['size'] if z['size'] else doc_base_size
-            
-            source_type = z.get('sourceType', 'excel') # excel по умолчанию
-            content_key = z.get('content', '')
-            
-            txt = ""
-            if source_type == 'text':
-                # Если режим текста - берем текст напрямую
-                txt = str(content_key)
-            else:
-                # Если режим Excel - ищем в строке
-                txt = str(df_row.get(content_key, ""))
-            
-            if not txt: continue
-            
-            self._fit_and_draw(txt_layer, txt, zone_font_pool, size, z, doc_phys, doc_color)
+    def _zone_text(self, z, df_row):
+        if z.source_type == 'text':
+            # Если режим текста - берем текст напрямую
+            return z.content
+        # Если режим Excel - ищем в строке
+        return str(df_row.get(z.content, ""))
 
-        out = Image.alpha_composite(base_img, txt_layer)
-        return out
+    def _plan_zone(self, z, doc, df_row):
+        """Планирует символы одной зоны (тратит rng документа). Пустой список - в зоне нечего рисовать"""
+        txt = self._zone_text(z, df_row)
+        if not txt: return []
 
-    def preview(self, img_path, config_json, df):
-        if df is not None and not df.empty: 
-            # Берем первую строку, индекс 0
-            row = df.iloc[0].to_dict()
-            idx = 0
-        else:
-            cfg = json.loads(config_json)
-            row = {z['column']: z['column'] for z in cfg['zones']}
-            # Добавим фейковый ID для превью, чтобы оно не скакало при каждом клике
-            row['ID'] = 'PREVIEW'
-            idx = 0
-        return self.process(img_path, row, config_json, row_index=idx)
-
-    def batch(self, bg_source, df, config_json, cb_prog, cb_done):
+        # Пустой пул у зоны - значит шрифт документа (random_per_doc)
+        zone_font_pool = z.font_pool or doc['font_pool']
+        size = z.size if z.size else doc['base_size']
+        return self._fit_and_plan(txt, zone_font_pool, size, z, doc['phys'], doc['color'], doc['rng'])
+
+    def preview(self, img_path, template, rows):
+        """rows - RowSource, DataFrame или None (тогда строка-заглушка из имен колонок)"""
+        tpl = template if isinstance(template, CompiledTemplate) else self.compile(template)
+        # Берем первую строку, индекс 0
+        row = next(iter_rows(rows, tpl.columns()), None) if rows is not None else None
+        if not row: row = tpl.row_template()
+        return self.process(img_path, row, tpl, row_index=0)
+
+    def batch(self, bg_source, rows, template, cb_prog, cb_done, workers=1, output=None, writers=2, resume=True,
+              progress=None, folder=None, shard=None, instrument=None, sink=None, control=None):
+        """
+        rows - RowSource (потоковое чтение xlsx/csv/parquet), DataFrame или итерируемый набор dict.
+        Из RowSource читаются только колонки, на которые ссылаются зоны, и ID;
+        рендер начинается сразу, пока остальные строки еще читаются.
+        output - OutputOptions (формат, качество); кодирование и запись идут
+        в writers отдельных потоках и не задерживают рендер следующей строки.
+        resume - пропускать строки, чьи документы уже есть и не изменились (см. core.manifest).
+        Манифест пишется и без resume.
+        progress - ProgressReporter (скорость, ETA, ошибки); если не задан, cb_prog(done, total)
+        вызывается через него же, то есть не чаще PROGRESS_RATE раз в секунду.
+        folder - папка вывода (по умолчанию OUTPUT_FOLDER).
+        shard - core.shard.Shard: рендерить только свою часть строк (манифест у шарда свой,
+        свести шарды и проверить покрытие - core.shard.merge_shards).
+        instrument - core.instrument.InstrumentOptions: замеры по этапам на строку и на пакет,
+        отчет пишется в folder/timings.json (и остается в self.timings).
+        sink - куда писать документы: 'files' (по умолчанию), 'dirs:1000', 'zip', 'tar', 'tiff:100',
+        'pdf:100' или готовый синк (см. core.sinks). Рядом пишется индекс: ID строки -> положение документа.
+        control - core.control.JobControl пакета (пауза, отмена); без него создается свой, stop() отменяет его.
+        Отмена прерывает и строки, которые уже рисуются: они не записываются и перерисуются при resume.
+        """
+        output = output or OutputOptions()
+        folder = folder or OUTPUT_FOLDER
+        if progress is None:
+            progress = ProgressReporter(lambda s: cb_prog(s['done'], s['total']) if cb_prog else None)
+        self.progress = progress
         if isinstance(bg_source, str): bg_list = [bg_source]
         else: bg_list = bg_source
-        self.is_running = True
-        total = len(df)
-        if not os.path.exists(OUTPUT_FOLDER): os.makedirs(OUTPUT_FOLDER)
+
+        timer = self.timer = StageTimer(instrument) if instrument else NULL_TIMER
+        # Шаблон разбираем один раз на весь пакет, а не на каждую строку
+        try:
+            tpl = template if isinstance(template, CompiledTemplate) else self.compile(template)
+            sink = make_sink(sink, folder, output, prefix=shard.prefix if shard else "docs",
+                             index_name=shard.index_name if shard else INDEX_NAME)
+        except (TemplateError, ValueError) as e:
+            print(f"Err template: {e}" if isinstance(e, TemplateError) else f"Err output: {e}")
+            self.timer = NULL_TIMER
+            progress.error()
+            progress.finish()
+            if cb_done: cb_done()
+            return
+
+        control = self.control = control or JobControl()
+        self.plan_report = None
+        # Индекс шрифтов готовим до запуска пула: процессы прочитают его из файла, а не разберут шрифты заново
+        self.fonts.index()
+        # Для потоковых источников число строк может быть неизвестно заранее (0)
+        total = count_rows(rows) or 0
+        if shard and shard.mode == 'range':
+            # Границы диапазонов должны совпадать на всех машинах, поэтому нужно точное число строк
+            total = total_rows(rows)
+            start, stop = shard.bounds(total)
+            progress.start(max(0, min(stop, total) - start))
+        else:
+            progress.start(total // shard.count if shard else total)
         bg_count = len(bg_list)
-        
-        # iterrows возвращает (index, Series)
-        # i - это индекс dataframe (он может быть не 0,1,2, если фильтровали), 
-        # поэтому лучше использовать enumerate для счетчика
-        for counter, (idx, row) in enumerate(df.iterrows()):
-            if not self.is_running: break
-            try:
-                current_bg_path = bg_list[counter % bg_count]
-                
-                # ПЕРЕДАЕМ ROW (это Series превращаем в dict для удобства)
-                # И ПЕРЕДАЕМ COUNTER как индекс
-                row_dict = row.to_dict()
-                
-                img = self.process(current_bg_path, row_dict, config_json, row_index=counter)
-                
-                if img: img.convert("RGB").save(os.path.join(OUTPUT_FOLDER, f"doc_{counter+1}.jpg"))
-                if cb_prog: cb_prog(counter+1, total)
-            except Exception as e: 
-                print(f"Err row {counter}: {e}")
-                
-        self.font_cache.clear()
-        self.is_running = False
+        columns = tpl.columns()
+
+        # Индекс строки в DataFrame может быть не 0,1,2 (если фильтровали),
+        # поэтому используем enumerate для счетчика и ПЕРЕДАЕМ COUNTER как индекс
+        jobs = ((counter, bg_list[counter % bg_count], row_dict)
+                for counter, row_dict in enumerate(prefetch(iter_rows(rows, columns))))
+
+        # Манифест пишем всегда (по нему работают resume и слияние шардов), resume - только пропуск готовых
+        manifest = Manifest(folder, shard.manifest_name if shard else MANIFEST_NAME)
+        # counter -> (seed key, хеш входов, ID строки) для строк, которые сейчас рендерятся
+        in_flight = {}
+        def written(counter, file_name, loc):
+            entry = in_flight.pop(counter, None)
+            if entry:
+                key, digest, row_id = entry
+                manifest.record(file_name, key, digest, loc)
+                sink.log(row_id, counter, file_name, loc)
+
+        def todo():
+            """Отсеивает строки, чьи документы уже готовы и входы не менялись"""
+            for counter, bg_path, row_dict in jobs:
+                key = self._seed_key(row_dict, counter, tpl.seed)
+                if shard and not shard.contains(counter, key, total):
+                    if shard.mode == 'range' and counter >= stop: return
+                    continue
+                digest = row_digest(key, row_dict, columns, bg_path, tpl, output, sink.kind)
+                if resume and manifest.is_current(doc_name(counter, output), key, digest):
+                    progress.update(skipped=True)
+                    continue
+                in_flight[counter] = (key, digest, self._row_id(row_dict))
+                yield counter, bg_path, row_dict
+
+        try:
+            with OutputStage(sink, workers=writers, on_written=written,
+                             on_failed=lambda counter: progress.error(), timer=timer) as out:
+                if workers > 1:
+                    self._batch_parallel(todo(), tpl, progress, workers, out, instrument)
+                else:
+                    for counter, current_bg_path, row_dict in todo():
+                        try:
+                            control.check()
+                            t0 = time.perf_counter()
+                            timer.begin_row(counter)
+                            img = self.process(current_bg_path, row_dict, tpl, row_index=counter)
+                            timer.end_row(counter)
+                            if img: out.submit(counter, img)
+                            progress.update(latency=time.perf_counter() - t0)
+                        except JobCancelled:
+                            timer.end_row(counter)
+                            break
+                        except Exception as e: 
+                            timer.end_row(counter)
+                            print(f"Err row {counter}: {e}")
+                            progress.update(error=True)
+                # Останавливаем фоновое чтение таблицы, если вышли раньше конца
+                jobs.close()
+        finally:
+            manifest.close()
+            if timer.enabled:
+                self.timings = timer
+                timer.dump(os.path.join(folder, TIMINGS_NAME))
+            self.timer = NULL_TIMER
+            self.control = NULL_CONTROL
+
+        progress.finish()
         if cb_done: cb_done()
 
-    def stop(self): self.is_running = False
\ No newline at end of file
+    def _batch_parallel(self, jobs, tpl, progress, workers, out, instrument=None):
+        """
+        Раздает строки пулу процессов. У каждой строки свой RNG (см. _make_rng),
+        поэтому результат побайтно совпадает с последовательным режимом.
+        Порядок и нарезку задает core.planner.CostPlanner: строки с оценкой стоимости
+        (длина текста зон, размеры зон и фона), дорогие первыми, дешевые пачками;
+        оценка против факта остается в self.plan_report.
+        В очереди держим не больше workers*2 задач, чтобы не копить весь Excel в памяти пула.
+        Пауза и отмена доходят до процессов через общий JobControl (см. _init_worker).
+        Процессы сами кодируют документ (это тоже CPU), на запись в out уходят готовые байты.
+        Замеры (instrument) процессы возвращают вместе с документом, здесь они сливаются в self.timer.
+        """
+        pending = {}
+        control = self.control
+        planner = CostPlanner(tpl, workers)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(self.bg_cache.max_bytes, instrument, control)) as pool:
+            for chunk in planner.chunks(jobs):
+                if control.cancelled: break
+                fut = pool.submit(_worker_render_chunk, chunk, tpl, out.options)
+                pending[fut] = [counter for counter, _, _ in chunk]
+                if len(pending) >= workers * 2:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    self._collect(finished, pending, progress, out, planner)
+
+            if control.cancelled:
+                for fut in pending: fut.cancel()
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                self._collect(finished, pending, progress, out, planner)
+        self.plan_report = planner.report()
+        if self.timer.enabled: self.timer.sections['plan'] = self.plan_report
+
+    def _collect(self, finished, pending, progress, out, planner):
+        for fut in finished:
+            counters = pending.pop(fut)
+            results = []
+            if not fut.cancelled():
+                try:
+                    results = fut.result()
+                except Exception as e:
+                    for counter in counters:
+                        print(f"Err row {counter}: {e}")
+                        progress.update(error=True)
+            for counter, data, elapsed, timings, error in results:
+                if error:
+                    print(f"Err row {counter}: {error}")
+                    progress.update(error=True)
+                    continue
+                self.timer.merge_row(timings)
+                if data: out.submit(counter, data)
+                progress.update(latency=elapsed)
+                planner.observe(counter, elapsed)
+            # Строки без результата (ошибка, отмена) оценку не уточняют
+            for counter in counters: planner.forget(counter)
+
+    def stop(self): self.control.cancel()
+
+    def pause(self): self.control.pause()
+
+    def resume(self): self.control.resume()
+
+
+# === ВОРКЕРЫ ПУЛА ПРОЦЕССОВ ===
+# Функции на уровне модуля, чтобы их можно было передать в другой процесс (pickle).
+# В каждом процессе свой Generator со своим кэшем шрифтов.
+_worker_gen = None
+
+def _init_worker(bg_cache_bytes=BG_CACHE_BYTES, instrument=None, control=NULL_CONTROL):
+    global _worker_gen
+    _worker_gen = Generator(bg_cache_bytes=bg_cache_bytes)
+    _worker_gen.fonts.index()
+    if instrument: _worker_gen.timer = StageTimer(instrument)
+    # Флаги паузы/отмены в разделяемой памяти: процесс видит их сразу, на каждом символе
+    _worker_gen.control = control
+
+def _worker_render_row(bg_path, row_dict, tpl, counter, output):
+    """
+    Рендерит строку и возвращает (закодированный документ или None, секунды на строку,
+    запись замеров строки или None, если замеры выключены)
+    """
+    timer = _worker_gen.timer
+    t0 = time.perf_counter()
+    timer.begin_row(counter)
+    try:
+        img = _worker_gen.process(bg_path, row_dict, tpl, row_index=counter)
+        with timer.stage('encode'):
+            data = encode_image(img, output) if img else None
+    finally:
+        timings = timer.end_row(counter, merge=False)
+    return data, time.perf_counter() - t0, timings
+
+def _worker_render_chunk(chunk, tpl, output):
+    """
+    Пачка строк [(counter, фон, строка)] -> [(counter, документ, секунды, замеры, ошибка или None)].
+    При отмене возвращает то, что успело отрисоваться: остальные строки не записаны и не ошибка.
+    """
+    results = []
+    for counter, bg_path, row_dict in chunk:
+        try:
+            data, elapsed, timings = _worker_render_row(bg_path, row_dict, tpl, counter, output)
+            results.append((counter, data, elapsed, timings, None))
+        except JobCancelled:
+            break
+        except Exception as e:
+            results.append((counter, None, 0.0, None, str(e)))
+    return results
@@ -0,0 +1,131 @@
+import io
+import os
+import secrets
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from PIL import Image, features
+from core.cache import LRUCache
+from core.manifest import file_stamp
+
+IMAGE_CACHE_BYTES = 128 * 1024 * 1024
+# Форматы, которые webview показывает сам: такие файлы отдаем как есть, без перекодирования
+BROWSER_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF', 'BMP')
+FRAME_FORMAT = 'WEBP' if features.check('webp') else 'JPEG'
+
+
+def encode_frame(img, fmt=FRAME_FORMAT, quality=85):
+    """Картинка -> (байты, mime) для отдачи в интерфейс"""
+    buf = io.BytesIO()
+    if fmt == 'WEBP':
+        # method=0 - самое быстрое сжатие, для превью важнее задержка, чем пара килобайт
+        img.save(buf, format='WEBP', quality=quality, method=0)
+    else:
+        img.convert("RGB").save(buf, format='JPEG', quality=quality)
+    return buf.getvalue(), Image.MIME[fmt]
+
+
+def encode_file(path, max_dim=None):
+    """
+    Файл картинки -> (байты, mime).
+    Без max_dim файл в формате, понятном браузеру, отдается как есть (координаты зон
+    в интерфейсе считаются в пикселях оригинала). С max_dim - уменьшенная копия.
+    """
+    with Image.open(path) as img:
+        fmt = img.format
+        if max_dim is None and fmt in BROWSER_FORMATS:
+            with open(path, 'rb') as f:
+                return f.read(), Image.MIME[fmt]
+        if max_dim:
+            # JPEG сразу декодируется в уменьшенном виде (draft), без полного разжатия
+            if fmt == 'JPEG': img.draft('RGB', (max_dim, max_dim))
+            img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+        else:
+            img.load()
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+        return encode_frame(img)
+
+
+class ImageServer:
+    """
+    Локальный HTTP-сервер картинок для интерфейса (только 127.0.0.1).
+    Вместо base64-строк через мост pywebview интерфейс получает URL и браузер
+    грузит бинарные данные сам, не блокируя JS. Отдаются только зарегистрированные
+    картинки (по случайному токену), произвольные пути с диска недоступны.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, cache_bytes=IMAGE_CACHE_BYTES):
+        self._sources = {}  # токен -> (path, max_dim)
+        self._frames = {}   # имя -> (байты, mime)
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._secret = secrets.token_hex(8)
+        self.cache = LRUCache(max_items=256, max_bytes=cache_bytes, sizeof=lambda v: len(v[0]))
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                token = self.path.split('?', 1)[0].rsplit('/', 1)[-1]
+                try:
+                    item = server._lookup(token)
+                except Exception as e:
+                    print(f"Err image {token}: {e}")
+                    item = None
+                if item is None:
+                    self.send_error(404)
+                    return
+                data, mime, immutable = item
+                self.send_response(200)
+                self.send_header('Content-Type', mime)
+                self.send_header('Content-Length', str(len(data)))
+                # URL файла меняется вместе с файлом, а у кадров превью есть ?v=N
+                self.send_header('Cache-Control', 'max-age=31536000, immutable' if immutable else 'no-cache')
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args): pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self.base_url = f"http://{host}:{self._httpd.server_address[1]}/img"
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def _lookup(self, token):
+        with self._lock:
+            frame = self._frames.get(token)
+            source = self._sources.get(token)
+        if frame is not None: return frame[0], frame[1], False
+        if source is None: return None
+        cached = self.cache.get(token)
+        if cached is None:
+            cached = encode_file(*source)
+            self.cache.put(token, cached)
+        return cached[0], cached[1], True
+
+    def file_url(self, path, max_dim=None):
+        """URL файла картинки (или его копии не больше max_dim по большей стороне)"""
+        if not path or not os.path.exists(path): return None
+        token = hashlib.md5(f"{self._secret}|{file_stamp(path)}|{max_dim}".encode('utf-8')).hexdigest()
+        with self._lock:
+            self._sources[token] = (path, max_dim)
+        return f"{self.base_url}/{token}"
+
+    def publish(self, name, img):
+        """
+        Кладет кадр (например, превью) под именем name и возвращает его URL.
+        Хранится только последний кадр на имя; ?v=N не дает webview показать старый из кэша.
+        """
+        return self.publish_frame(name, encode_frame(img))
+
+    def publish_frame(self, name, frame):
+        """То же для уже закодированного кадра (байты, mime)"""
+        with self._lock:
+            self._frames[name] = frame
+            self._versions[name] = v = self._versions.get(name, 0) + 1
+        return f"{self.base_url}/{name}?v={v}"
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
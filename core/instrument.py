@@ -0,0 +1,244 @@
+import json
+import time
+import heapq
+import cProfile
+import pstats
+import threading
+import tracemalloc
+from dataclasses import dataclass
+
+TIMINGS_NAME = "timings.json"
+
+
+@dataclass(frozen=True)
+class InstrumentOptions:
+    """
+    Что собирать при замерах (передается и в процессы пула).
+    profile_rows - (start, stop): для этих строк включается cProfile (и tracemalloc при memory=True).
+    detail_rows - (start, stop): для этих строк в отчет попадает разбивка по этапам.
+    keep_slowest - сколько самых медленных строк (с разбивкой) держать в отчете.
+    """
+    profile_rows: tuple = None
+    memory: bool = False
+    detail_rows: tuple = None
+    keep_slowest: int = 20
+
+
+def _in(rng, counter):
+    return rng is not None and rng[0] <= counter < rng[1]
+
+
+class _NullStage:
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+_NULL_STAGE = _NullStage()
+
+
+class NullTimer:
+    """
+    Выключенные замеры (по умолчанию): все методы пустые, stage() отдает один и тот же
+    пустой контекст. Цена замера в горячем коде - один вызов метода.
+    """
+    enabled = False
+    def stage(self, name): return _NULL_STAGE
+    def add(self, name, seconds): pass
+    def count(self, name, n=1): pass
+    def begin_row(self, counter): pass
+    def end_row(self, counter, merge=True): return None
+    def merge_row(self, rec): pass
+
+NULL_TIMER = NullTimer()
+
+
+class _Stage:
+    __slots__ = ('timer', 'name', 't0')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.t0)
+        return False
+
+
+class StageTimer:
+    """
+    Время по этапам рендера и счетчики (промахи кэшей, глифы) на строку и на пакет.
+    Пока строка рендерится (begin_row..end_row), замеры копятся в записи строки этого потока,
+    в конце строки сливаются в общие итоги. Замеры вне строки (кодирование и запись в потоках
+    OutputStage) идут сразу в итоги. Записи строк из процессов пула сливаются через merge_row.
+    """
+    enabled = True
+
+    def __init__(self, options=None):
+        self.options = options or InstrumentOptions()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stages = {}    # имя -> [секунды, вызовы]
+        self.counters = {}
+        self.rows = 0
+        self.row_seconds = 0.0
+        self.slowest = []   # куча (секунды, строка, запись)
+        self.details = []
+        self.sections = {}  # Дополнительные разделы отчета (например, 'plan' - оценка стоимости строк)
+        self._pstats = None
+        self._started = time.perf_counter()
+
+    # --- замеры ---
+
+    def stage(self, name): return _Stage(self, name)
+
+    def add(self, name, seconds):
+        rec = getattr(self._local, 'row', None)
+        if rec is not None:
+            st = rec['stages'].get(name)
+            if st is None: rec['stages'][name] = [seconds, 1]
+            else:
+                st[0] += seconds
+                st[1] += 1
+            return
+        with self._lock:
+            st = self.stages.setdefault(name, [0.0, 0])
+            st[0] += seconds
+            st[1] += 1
+
+    def count(self, name, n=1):
+        rec = getattr(self._local, 'row', None)
+        if rec is not None:
+            rec['counters'][name] = rec['counters'].get(name, 0) + n
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    # --- строки ---
+
+    def begin_row(self, counter):
+        opts = self.options
+        rec = {'row': counter, 'stages': {}, 'counters': {}, 't0': time.perf_counter()}
+        if _in(opts.profile_rows, counter):
+            rec['_profile'] = cProfile.Profile()
+            if opts.memory:
+                if not tracemalloc.is_tracing(): tracemalloc.start()
+                tracemalloc.reset_peak()
+            rec['_profile'].enable()
+        self._local.row = rec
+
+    def end_row(self, counter, merge=True):
+        """
+        Закрывает строку и возвращает ее запись. merge=False - не сливать в итоги этого таймера
+        (процесс пула отдает запись в основной процесс, там ее сливает merge_row).
+        """
+        rec = getattr(self._local, 'row', None)
+        if rec is None: return None
+        self._local.row = None
+        prof = rec.pop('_profile', None)
+        if prof is not None:
+            prof.disable()
+            if self.options.memory:
+                # Без аллокаций самих профилировщиков
+                snap = tracemalloc.take_snapshot().filter_traces((
+                    tracemalloc.Filter(False, cProfile.__file__),
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+                ))
+                rec['memory'] = {
+                    'peak_kb': round(tracemalloc.get_traced_memory()[1] / 1024, 1),
+                    'top': [f"{s.traceback[0].filename}:{s.traceback[0].lineno} {s.size / 1024:.1f} KB"
+                            for s in snap.statistics('lineno')[:5]],
+                }
+            prof.create_stats()
+            rec['profile'] = prof.stats
+        rec['seconds'] = time.perf_counter() - rec.pop('t0')
+        if merge: self.merge_row(rec)
+        return rec
+
+    def merge_row(self, rec):
+        if not rec: return
+        opts = self.options
+        profile = rec.pop('profile', None)
+        with self._lock:
+            self.rows += 1
+            self.row_seconds += rec['seconds']
+            for name, (sec, calls) in rec['stages'].items():
+                st = self.stages.setdefault(name, [0.0, 0])
+                st[0] += sec
+                st[1] += calls
+            for name, n in rec['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            item = (rec['seconds'], rec['row'], rec)
+            if len(self.slowest) < opts.keep_slowest: heapq.heappush(self.slowest, item)
+            elif opts.keep_slowest: heapq.heappushpop(self.slowest, item)
+            if _in(opts.detail_rows, rec['row']) or _in(opts.profile_rows, rec['row']):
+                self.details.append(rec)
+            if profile is not None:
+                snap = _StatsSnapshot(profile)
+                if self._pstats is None: self._pstats = pstats.Stats(snap)
+                else: self._pstats.add(snap)
+
+    # --- отчет ---
+
+    def report(self, top=30):
+        """
+        Итоги: этапы по убыванию времени (share - доля от суммарного времени строк; этапы
+        могут быть вложены, например font_load внутри fit), счетчики, самые медленные строки,
+        разбивка для detail_rows/profile_rows и верх профиля cProfile.
+        """
+        with self._lock:
+            total = self.row_seconds or sum(sec for sec, _ in self.stages.values()) or 1.0
+            stages = {
+                name: {'seconds': round(sec, 4), 'calls': calls,
+                       'mean_ms': round(sec / calls * 1000, 4) if calls else 0.0,
+                       'share': round(sec / total, 4)}
+                for name, (sec, calls) in sorted(self.stages.items(), key=lambda kv: -kv[1][0])
+            }
+            rep = {
+                'wall_seconds': round(time.perf_counter() - self._started, 3),
+                'rows': self.rows,
+                'row_seconds': round(self.row_seconds, 3),
+                'row_mean_ms': round(self.row_seconds / self.rows * 1000, 3) if self.rows else None,
+                'stages': stages,
+                'counters': dict(sorted(self.counters.items())),
+                'slowest_rows': [_row_summary(r) for _, _, r in sorted(self.slowest, key=lambda i: -i[0])],
+                'rows_detail': [_row_summary(r) for r in sorted(self.details, key=lambda r: r['row'])],
+            }
+            if self._pstats is not None:
+                rep['profile_top'] = _profile_top(self._pstats, top)
+            rep.update(self.sections)
+        return rep
+
+    def dump(self, path):
+        """JSON-отчет в path; если был cProfile - рядом path.prof для snakeviz/pstats"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2, ensure_ascii=False)
+        if self._pstats is not None:
+            self._pstats.dump_stats(path + ".prof")
+
+
+class _StatsSnapshot:
+    """pstats.Stats принимает объекты с create_stats() и .stats - так сливаем профили из процессов"""
+    def __init__(self, stats): self.stats = stats
+    def create_stats(self): pass
+
+
+def _row_summary(rec):
+    out = {'row': rec['row'], 'seconds': round(rec['seconds'], 4),
+           'stages': {k: round(v[0], 4) for k, v in sorted(rec['stages'].items(), key=lambda kv: -kv[1][0])},
+           'counters': rec['counters']}
+    if 'memory' in rec: out['memory'] = rec['memory']
+    return out
+
+
+def _profile_top(stats, top):
+    rows = []
+    for (file, line, func), (cc, nc, tt, ct, _) in stats.stats.items():
+        rows.append({'function': f"{func} ({file}:{line})", 'calls': nc,
+                     'tottime': round(tt, 4), 'cumtime': round(ct, 4)})
+    rows.sort(key=lambda r: -r['tottime'])
+    return rows[:top]
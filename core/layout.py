@@ -0,0 +1,114 @@
+from core.cache import LRUCache
+
+MIN_FONT_SIZE = 12 # Меньше этого текст в зону не ужимаем
+SIZE_STEP = 2      # Шаг размеров, как в прежнем подборе (max_size, max_size-2, ...)
+
+
+class TextFitter:
+    """
+    Подбор размера шрифта под зону.
+    - ширина каждого слова меряется один раз на (шрифт, размер);
+    - перенос строк кэшируется на (текст, шрифт, размер, ширина зоны);
+    - размер ищется бинарным поиском по той же лестнице max_size, max_size-2, ... 12;
+    - итоговый размер кэшируется на (текст, шрифт, max_size, зона) между строками Excel.
+    get_font(font_name, size) -> FreeTypeFont или None.
+    """
+
+    def __init__(self, get_font, cache_size=8192):
+        self.get_font = get_font
+        self.word_cache = LRUCache(cache_size * 4)
+        self.wrap_cache = LRUCache(cache_size)
+        self.fit_cache = LRUCache(cache_size)
+
+    def _word_width(self, font_name, size, font, word):
+        key = (font_name, size, word)
+        w = self.word_cache.get(key)
+        if w is None:
+            w = font.getlength(word)
+            self.word_cache.put(key, w)
+        return w
+
+    def wrap(self, text, font_name, size, max_width):
+        """
+        Перенос по словам как в utils.wrap_text, но без повторных замеров растущей строки:
+        ширина строки = сумма ширин слов + пробелы. Возвращает (строки, ascent + descent).
+        """
+        key = (text, font_name, size, max_width)
+        cached = self.wrap_cache.get(key)
+        if cached is not None: return cached
+
+        font = self.get_font(font_name, size)
+        if not font: return None
+        space_w = self._word_width(font_name, size, font, ' ')
+
+        lines = []
+        for paragraph in text.split('\n'):
+            words = paragraph.split()
+            if not words:
+                lines.append("")
+                continue
+            current_line = words[0]
+            current_w = self._word_width(font_name, size, font, words[0])
+            for word in words[1:]:
+                word_w = self._word_width(font_name, size, font, word)
+                if current_w + space_w + word_w <= max_width:
+                    current_line += " " + word
+                    current_w += space_w + word_w
+                else:
+                    lines.append(current_line)
+                    current_line = word
+                    current_w = word_w
+            lines.append(current_line)
+
+        ascent, descent = font.getmetrics()
+        cached = (lines, ascent + descent)
+        self.wrap_cache.put(key, cached)
+        return cached
+
+    def _fits(self, text, font_name, size, w_box, h_box, spacing):
+        wrapped = self.wrap(text, font_name, size, w_box)
+        if not wrapped or not wrapped[0]: return None
+        lines, unit_h = wrapped
+        line_height = unit_h * spacing
+        return len(lines) * line_height <= h_box
+
+    def fit(self, text, font_name, max_size, w_box, h_box, spacing=1.0):
+        """
+        Наибольший размер из лестницы, при котором текст влезает в зону.
+        spacing - множитель межстрочного интервала (случайный на каждую зону документа).
+        Возвращает (размер, строки, высота строки) или None, если не влезает даже MIN_FONT_SIZE.
+        """
+        sizes = list(range(max_size, MIN_FONT_SIZE - 1, -SIZE_STEP))
+        if not sizes: return None
+
+        # Прошлый результат для этой зоны проверяем под текущий spacing: обычно он тот же
+        key = (text, font_name, max_size, w_box, h_box)
+        size = self.fit_cache.get(key)
+        if size is None or not self._fits(text, font_name, size, w_box, h_box, spacing) or (
+                size != max_size and self._fits(text, font_name, size + SIZE_STEP, w_box, h_box, spacing)):
+            size = self._search(text, font_name, sizes, w_box, h_box, spacing)
+            if size is None: return None
+            self.fit_cache.put(key, size)
+
+        lines, unit_h = self.wrap(text, font_name, size, w_box)
+        return size, lines, unit_h * spacing
+
+    def _search(self, text, font_name, sizes, w_box, h_box, spacing):
+        # Чаще всего текст влезает сразу в максимальный размер
+        first = self._fits(text, font_name, sizes[0], w_box, h_box, spacing)
+        if first is None: return None
+        if first: return sizes[0]
+
+        # sizes убывают; ищем первый индекс, где текст влезает
+        lo, hi = 1, len(sizes) - 1
+        found = None
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            ok = self._fits(text, font_name, sizes[mid], w_box, h_box, spacing)
+            if ok is None: return None
+            if ok:
+                found = mid
+                hi = mid - 1
+            else:
+                lo = mid + 1
+        return sizes[found] if found is not None else None
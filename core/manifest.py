@@ -0,0 +1,95 @@
+import os
+import json
+import hashlib
+import threading
+
+MANIFEST_NAME = "manifest.jsonl"
+# Меняем, когда меняется сам рендер: старые записи перестанут совпадать и строки перерисуются
+RENDER_VERSION = 1
+
+
+def file_stamp(path):
+    """Дешевый отпечаток файла: путь, mtime и размер (без чтения содержимого)"""
+    try:
+        st = os.stat(path)
+        return f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}"
+    except OSError:
+        return f"{path}|missing"
+
+
+def row_digest(seed_key, row, columns, bg_path, tpl, output, sink='files'):
+    """
+    Хеш всех входов строки: значения колонок из шаблона, seed, фон, шаблон и настройки вывода
+    (включая вид синка, если документы пишутся не отдельными файлами).
+    Если он совпадает с записью в манифесте и файл на месте - документ перерисовывать не нужно.
+    """
+    payload = {
+        'v': RENDER_VERSION,
+        'seed_key': seed_key,
+        'values': {c: str(row.get(c, "")) for c in columns},
+        'bg': file_stamp(bg_path),
+        'template': tpl.fingerprint,
+        'output': repr(output),
+    }
+    if sink != 'files': payload['sink'] = sink
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def record_path(rec):
+    """Файл, в котором лежит документ записи: сам doc_N или контейнер (ZIP, TIFF, ...), см. core.sinks"""
+    loc = rec.get('loc')
+    return loc['path'] if loc else rec['file']
+
+
+class Manifest:
+    """
+    Журнал готовых документов в папке вывода (JSON Lines, одна запись на документ):
+    {"file": "doc_7.jpg", "key": "<seed key>", "hash": "<row_digest>"}, у документов
+    не отдельными файлами еще "loc" - положение в синке ({"path": "docs-0001.zip", "member": ...}).
+    Записи дописываются сразу после записи файла, поэтому после падения
+    или stop_generation следующий запуск продолжит с места остановки.
+    """
+
+    def __init__(self, folder, name=MANIFEST_NAME):
+        self.path = os.path.join(folder, name)
+        self.folder = folder
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._load()
+        os.makedirs(folder, exist_ok=True)
+        self._fh = open(self.path, 'a', encoding='utf-8')
+
+    def _load(self):
+        if not os.path.exists(self.path): return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    self.entries[rec['file']] = rec
+                except (ValueError, KeyError):
+                    continue  # оборванная последняя строка после падения
+
+    def is_current(self, file_name, key, digest):
+        rec = self.entries.get(file_name)
+        return (rec is not None and rec.get('key') == key and rec.get('hash') == digest
+                and os.path.exists(os.path.join(self.folder, record_path(rec))))
+
+    def record(self, file_name, key, digest, loc=None):
+        rec = {'file': file_name, 'key': key, 'hash': digest}
+        # Для обычного файла положение совпадает с именем - не пишем, формат журнала прежний
+        if loc and loc != {'path': file_name}: rec['loc'] = loc
+        with self._lock:
+            self.entries[file_name] = rec
+            self._fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self._fh.flush()
+
+    def close(self):
+        """Закрывает журнал и переписывает его без устаревших повторов"""
+        with self._lock:
+            self._fh.close()
+            tmp = self.path + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                for rec in self.entries.values():
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
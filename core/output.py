@@ -0,0 +1,133 @@
+import io
+import queue
+import threading
+from dataclasses import dataclass
+from core.instrument import NULL_TIMER
+
+# Формат -> (имя формата Pillow, расширение файла)
+FORMATS = {
+    'jpg':  ('JPEG', '.jpg'),
+    'jpeg': ('JPEG', '.jpg'),
+    'png':  ('PNG', '.png'),
+    'webp': ('WEBP', '.webp'),
+    'tif':  ('TIFF', '.tif'),
+    'tiff': ('TIFF', '.tif'),
+}
+
+
+@dataclass(frozen=True)
+class OutputOptions:
+    """
+    Как кодировать готовые документы.
+    quality=None - значение Pillow по умолчанию (для JPEG это 75, как было раньше).
+    optimize/progressive - для JPEG (optimize также для PNG), lossless/method - для WebP.
+    TIFF сжимается JPEG (с quality), при lossless - Deflate.
+    """
+    fmt: str = 'jpg'
+    quality: int = None
+    optimize: bool = False
+    progressive: bool = False
+    lossless: bool = False
+    method: int = None
+
+    def __post_init__(self):
+        if self.fmt.lower() not in FORMATS:
+            raise ValueError(f"Неизвестный формат вывода: {self.fmt}")
+
+    @property
+    def pil_format(self): return FORMATS[self.fmt.lower()][0]
+
+    @property
+    def ext(self): return FORMATS[self.fmt.lower()][1]
+
+    def save_params(self):
+        params = {}
+        if self.pil_format == 'JPEG':
+            if self.quality is not None: params['quality'] = self.quality
+            if self.optimize: params['optimize'] = True
+            if self.progressive: params['progressive'] = True
+        elif self.pil_format == 'PNG':
+            if self.optimize: params['optimize'] = True
+        elif self.pil_format == 'WEBP':
+            if self.quality is not None: params['quality'] = self.quality
+            if self.lossless: params['lossless'] = True
+            if self.method is not None: params['method'] = self.method
+        elif self.pil_format == 'TIFF':
+            params['compression'] = 'tiff_deflate' if self.lossless else 'jpeg'
+            if self.quality is not None and not self.lossless: params['quality'] = self.quality
+        return params
+
+
+def encode_image(img, options):
+    """Кодирует документ в байты выбранного формата (документ непрозрачный, поэтому RGB)"""
+    params = options.save_params()
+    # Документ в уменьшенном рабочем разрешении (target_dpi/max_dim) - пишем его настоящий dpi
+    if img.info.get('render_scale') and img.info.get('dpi'): params['dpi'] = img.info['dpi']
+    img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format=options.pil_format, **params)
+    return buf.getvalue()
+
+
+def doc_name(counter, options):
+    return f"doc_{counter+1}{options.ext}"
+
+
+class OutputStage:
+    """
+    Кодирование и запись документов в отдельных потоках.
+    Рендер кладет картинку (или уже закодированные байты) в ограниченную очередь и
+    идет дальше; если диск не успевает, submit() ждет место в очереди (без роста памяти).
+    sink - куда писать (core.sinks: файлы, подпапки, ZIP/TAR, многостраничные TIFF/PDF);
+    документы кодируются в sink.options, имена doc_N - по sink.output.
+    on_written(counter, file_name, loc) вызывается из потока записи после успешной записи
+    (loc - положение документа в синке), on_failed(counter) - если документ не удалось
+    закодировать или записать.
+    timer - core.instrument.StageTimer для замеров encode/write (по умолчанию выключен).
+    """
+
+    def __init__(self, sink, workers=2, queue_size=8, on_written=None, on_failed=None, timer=NULL_TIMER):
+        self.sink = sink
+        self.options = sink.options
+        self.on_written = on_written
+        self.on_failed = on_failed
+        self.timer = timer
+        self.written = 0
+        self.errors = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(max(1, workers))]
+        for t in self._threads: t.start()
+
+    def submit(self, counter, image_or_bytes):
+        """Ставит документ в очередь на запись (блокируется, если очередь полна)"""
+        self._queue.put((counter, image_or_bytes))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None: return
+            counter, data = item
+            try:
+                if not isinstance(data, bytes):
+                    with self.timer.stage('encode'):
+                        data = encode_image(data, self.options)
+                name = doc_name(counter, self.sink.output)
+                with self.timer.stage('write'):
+                    loc = self.sink.write(name, counter, data)
+                with self._lock: self.written += 1
+                if self.on_written: self.on_written(counter, name, loc)
+            except Exception as e:
+                with self._lock: self.errors += 1
+                print(f"Err write row {counter}: {e}")
+                if self.on_failed: self.on_failed(counter)
+
+    def close(self):
+        """Дожидается записи всего, что уже в очереди, и закрывает синк"""
+        for _ in self._threads: self._queue.put(None)
+        for t in self._threads: t.join()
+        self.sink.close()
+
+    def __enter__(self): return self
+
+    def __exit__(self, *exc): self.close()
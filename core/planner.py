@@ -0,0 +1,170 @@
+import math
+import numpy as np
+from PIL import Image
+from core.layout import MIN_FONT_SIZE
+
+PLAN_WINDOW = 256     # Сколько строк вперед планировщик видит и упорядочивает
+CHUNK_SECONDS = 0.25  # Дешевые строки собираются в задания примерно такой (оценочной) длительности
+MIN_FIT_ROWS = 16     # С какого числа замеров веса модели уточняются по факту
+GLYPH_AREA = 0.72     # Площадь символа с интервалами в долях size^2 (ширина ~0.6, строка ~1.2)
+CLASSIC_COST = 60     # Во столько раз classic дороже fused на пиксель холста символа (холст x3, цепочка ресэмплов)
+# Начальные веса (секунды, замерены на fused + JPEG): на строку, на мегапиксель фона,
+# на символ, на мегапиксель холстов символов
+DEFAULT_WEIGHTS = (0.005, 0.007, 0.00025, 0.06)
+
+
+class CostModel:
+    """
+    Оценка времени рендера строки до рендера. Признаки:
+    - мегапиксели фона (копия, композит, кодирование) - размер берется из заголовка файла;
+    - число символов по зонам (текст из колонок content строки и текстовые зоны);
+    - мегапиксели холстов символов: размер символа - шрифт зоны, уменьшенный до того,
+      что влезает в зону при такой длине текста, с учетом масштаба рендера,
+      режима рендера (см. CLASSIC_COST) и эффектов (distortion, blur).
+    Веса уточняются по фактическому времени строк: МНК с притяжением к начальным весам,
+    поэтому признак, который в пакете не меняется (один фон), не уводит модель в сторону.
+    """
+
+    def __init__(self, tpl, weights=DEFAULT_WEIGHTS):
+        self.tpl = tpl
+        self.prior = np.asarray(weights, dtype=float)
+        self.weights = self.prior.copy()
+        self._bg_mpx = {}
+        self._obs_x = []
+        self._obs_y = []
+        phys = dict(tpl.phys)
+        mid = lambda v: (v[0] + v[1]) / 2 if isinstance(v, tuple) else v
+        # Холст символа - 2.5 размера
+        factor = 2.5 ** 2 * (CLASSIC_COST if tpl.render_mode != 'fused' else 1)
+        if mid(phys['distortion']) > 0: factor *= 1.3
+        factor *= 1 + 0.15 * mid(phys['blur'])
+        self._glyph_factor = factor / 1e6
+        self._doc_size = mid(tpl.size)
+
+    def _bg(self, path):
+        """(мегапиксели фона в рабочем разрешении, квадрат масштаба рендера для этого фона)"""
+        info = self._bg_mpx.get(path)
+        if info is None:
+            try:
+                with Image.open(path) as im:
+                    w, h = im.size
+                    # Масштаб как в Generator._fit_resolution: превью/целевое разрешение (target_dpi, max_dim)
+                    scale = self.tpl.scale * self.tpl.resolution_scale(im.size, im.info.get('dpi'))
+                info = (w * h * scale ** 2 / 1e6, scale ** 2)
+            except OSError:
+                info = (0.0, self.tpl.scale ** 2)
+            self._bg_mpx[path] = info
+        return info
+
+    def features(self, row, bg_path):
+        bg_mpx, scale2 = self._bg(bg_path)
+        glyphs = glyph_mpx = 0.0
+        for z in self.tpl.zones:
+            text = z.content if z.source_type == 'text' else str(row.get(z.content, ""))
+            n = len(text) - text.count(' ')
+            if n <= 0: continue
+            size = z.size or self._doc_size
+            # Длинный текст ужимается под зону (но не меньше MIN_FONT_SIZE)
+            fit = math.sqrt(z.width * z.height / (GLYPH_AREA * n))
+            size = max(MIN_FONT_SIZE, min(size, fit))
+            glyphs += n
+            glyph_mpx += n * size * size * scale2 * self._glyph_factor
+        return (1.0, bg_mpx, glyphs, glyph_mpx)
+
+    def predict(self, feats):
+        return float(np.dot(self.weights, feats))
+
+    def observe(self, feats, seconds):
+        self._obs_x.append(feats)
+        self._obs_y.append(seconds)
+        n = len(self._obs_y)
+        # Пересчет на 16, 32, 64, ... замерах: дешево и успевает за сменой характера строк
+        if n >= MIN_FIT_ROWS and n & (n - 1) == 0: self.refit()
+
+    def refit(self):
+        """Множители к начальным весам: (Z'Z + a*I) m = Z'y + a, где Z - вклады признаков по начальным весам"""
+        z = np.asarray(self._obs_x) * self.prior
+        y = np.asarray(self._obs_y)
+        zz = z.T @ z
+        a = 1e-2 * np.trace(zz) / len(self.prior) + 1e-12
+        m = np.linalg.solve(zz + a * np.eye(len(self.prior)), z.T @ y + a)
+        self.weights = self.prior * np.maximum(m, 0.0)
+
+
+class CostPlanner:
+    """
+    Порядок и нарезка строк для пула процессов. Строки берутся окнами (первое маленькое,
+    чтобы рендер начался сразу, дальше до PLAN_WINDOW), в окне сортируются по оценке
+    от дорогих к дешевым (longest-first), дешевые собираются в задания ~CHUNK_SECONDS.
+    Окна идут потоком без барьера: пока дорабатывает хвост одного, уже идет следующее,
+    а в конце пакета остаются только дешевые задания - ядра не простаивают.
+    Оценка и факт каждой строки копятся для report().
+    """
+
+    def __init__(self, tpl, workers, window=PLAN_WINDOW, chunk_seconds=CHUNK_SECONDS):
+        self.model = CostModel(tpl)
+        self.workers = workers
+        self.window = window
+        self.chunk_seconds = chunk_seconds
+        self._feats = {}      # counter -> признаки (до факта)
+        self._predicted = {}  # counter -> оценка на момент планирования
+        self.pairs = []       # (оценка, факт) по отрисованным строкам
+
+    def chunks(self, jobs):
+        """(counter, bg_path, row) -> списки таких строк, дорогие первыми в каждом окне"""
+        size = max(2, self.workers * 2)
+        window = []
+        for job in jobs:
+            window.append(job)
+            if len(window) >= size:
+                yield from self._plan(window)
+                window = []
+                size = min(self.window, size * 2)
+        if window: yield from self._plan(window)
+
+    def _plan(self, window):
+        costs = []
+        for job in window:
+            counter, bg_path, row = job
+            feats = self.model.features(row, bg_path)
+            cost = self.model.predict(feats)
+            self._feats[counter] = feats
+            self._predicted[counter] = cost
+            costs.append((cost, job))
+        costs.sort(key=lambda c: -c[0])
+        chunk, total = [], 0.0
+        for cost, job in costs:
+            if chunk and total + cost > self.chunk_seconds:
+                yield chunk
+                chunk, total = [], 0.0
+            chunk.append(job)
+            total += cost
+        if chunk: yield chunk
+
+    def observe(self, counter, seconds):
+        """Фактическое время строки (из процесса пула)"""
+        feats = self._feats.pop(counter, None)
+        predicted = self._predicted.pop(counter, None)
+        if feats is None: return
+        self.pairs.append((predicted, seconds))
+        self.model.observe(feats, seconds)
+
+    def forget(self, counter):
+        """Строка не отрисована (ошибка, отмена) - факта не будет"""
+        self._feats.pop(counter, None)
+        self._predicted.pop(counter, None)
+
+    def report(self):
+        """Оценка против факта: суммы, средняя ошибка по строке, корреляция, итоговые веса"""
+        if not self.pairs: return None
+        p, a = np.asarray(self.pairs).T
+        corr = float(np.corrcoef(p, a)[0, 1]) if len(p) > 2 and p.std() > 0 and a.std() > 0 else None
+        return {
+            'rows': len(p),
+            'predicted_seconds': round(float(p.sum()), 3),
+            'actual_seconds': round(float(a.sum()), 3),
+            'mean_abs_error_pct': round(float(np.mean(np.abs(p - a) / np.maximum(a, 1e-6))) * 100, 1),
+            'correlation': round(corr, 3) if corr is not None else None,
+            'weights': dict(zip(('row', 'background_mpx', 'glyph', 'glyph_mpx'),
+                                (round(float(w), 6) for w in self.model.weights))),
+        }
@@ -0,0 +1,130 @@
+import json
+import hashlib
+import threading
+from dataclasses import replace
+from PIL import Image
+from core.cache import LRUCache
+from core.template import CompiledTemplate
+from core.generator import _glyphs_bbox
+from core.sources import RowSource, iter_rows
+
+PREVIEW_MAX_DIM = 1600 # Рабочее разрешение превью (по большей стороне)
+ZONE_CACHE_BYTES = 256 * 1024 * 1024
+
+
+class PreviewCancelled(Exception):
+    """Пришел более новый запрос превью - текущий рендер больше никому не нужен"""
+
+
+class PreviewRenderer:
+    """
+    Превью для интерфейса:
+    - рендер в уменьшенном рабочем разрешении (CompiledTemplate.scaled), картинка выглядит как итоговая;
+    - рендерится только самый свежий запрос, устаревшие возвращают None и прерываются между зонами;
+    - слои зон кэшируются вместе с состоянием rng после зоны, поэтому при правке одной зоны
+      перерисовываются только она и зоны после нее, а результат совпадает с полным рендером.
+    """
+
+    def __init__(self, gen, max_dim=PREVIEW_MAX_DIM, zone_cache_bytes=ZONE_CACHE_BYTES):
+        self.gen = gen
+        self.max_dim = max_dim
+        # ключ префикса зон -> (состояние rng после зоны, слой зоны или None, смещение слоя)
+        self.zone_cache = LRUCache(max_items=512, max_bytes=zone_cache_bytes,
+                                   sizeof=lambda v: v[1].width * v[1].height * 4 if v[1] else 64)
+        self._cond = threading.Condition()
+        self._latest = 0
+        self._pending = None
+        self._results = {}
+        self._first_rows = {}
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def render(self, img_path, template, rows):
+        """
+        Ставит запрос и ждет результат. Возвращает Image или None, если запрос
+        вытеснен более новым (его результат уже никто не увидит).
+        """
+        with self._cond:
+            self._latest += 1
+            seq = self._latest
+            # Еще не начатый предыдущий запрос просто выбрасываем
+            if self._pending: self._results[self._pending[0]] = None
+            self._pending = (seq, img_path, template, rows)
+            self._cond.notify_all()
+            while seq not in self._results:
+                self._cond.wait()
+            result = self._results.pop(seq)
+        if isinstance(result, Exception): raise result
+        return result
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                seq, img_path, template, rows = self._pending
+                self._pending = None
+            try:
+                result = self._render(seq, img_path, template, rows)
+            except PreviewCancelled:
+                result = None
+            except Exception as e:
+                result = e  # ошибку поднимаем в потоке вызывающего
+            with self._cond:
+                self._results[seq] = result
+                self._cond.notify_all()
+
+    def _check(self, seq):
+        if self._latest != seq: raise PreviewCancelled()
+
+    def _first_row(self, rows, tpl):
+        if rows is None: return tpl.row_template()
+        # Первую строку таблицы читаем один раз на источник, а не на каждый сдвиг слайдера
+        key = id(rows)
+        if key not in self._first_rows:
+            if isinstance(rows, RowSource): row = rows.first_row()
+            else: row = next(iter_rows(rows), None)
+            self._first_rows = {key: row}
+        return self._first_rows[key] or tpl.row_template()
+
+    def _render(self, seq, img_path, template, rows):
+        gen = self.gen
+        tpl = template if isinstance(template, CompiledTemplate) else gen.compile(template)
+        row = self._first_row(rows, tpl)
+
+        # Сначала рабочее разрешение документа (target_dpi, max_dim), от него - разрешение превью
+        tpl, _ = gen._fit_resolution(tpl, img_path)
+        w, h = gen._background_info(img_path)[0]
+        factor = min(1.0, self.max_dim / (max(w, h) * tpl.scale))
+        tpl = tpl.scaled(factor)
+
+        base = gen._load_background(img_path, tpl.scale)
+        if not tpl.fonts: return base
+        self._check(seq)
+
+        doc = gen._begin_doc(tpl, row, 0)
+        rng = doc['rng']
+        # Все, что влияет на зоны, кроме самих зон: фон, масштаб, глобальные параметры, строка
+        prefix = hashlib.md5(json.dumps([
+            img_path, repr(replace(tpl, zones=(), fingerprint='')), row,
+        ], sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+
+        for z in tpl.zones:
+            self._check(seq)
+            prefix.update(repr(z).encode('utf-8'))
+            key = prefix.hexdigest()
+            cached = self.zone_cache.get(key)
+            if cached is not None:
+                state, layer, offset = cached
+                rng.setstate(state)
+            else:
+                glyphs = gen._plan_zone(z, doc, row)
+                box = _glyphs_bbox(glyphs, base.size)
+                layer, offset = None, (0, 0)
+                if box:
+                    offset = box[:2]
+                    layer = Image.new('RGBA', (box[2] - box[0], box[3] - box[1]), (255,255,255,0))
+                    gen._render_glyphs(layer, glyphs, doc['phys'], offset)
+                    if tpl.ink_effects == 'layer': layer = gen._apply_ink(layer, doc, offset)
+                self.zone_cache.put(key, (rng.getstate(), layer, offset))
+            if layer: base.alpha_composite(layer, offset)
+        return base
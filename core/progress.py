@@ -0,0 +1,87 @@
+import time
+import threading
+from collections import deque
+
+PROGRESS_RATE = 4.0   # Не больше стольких обновлений интерфейса в секунду
+PROGRESS_WINDOW = 50  # По скольким последним документам считаем скорость и время на строку
+
+
+class ProgressReporter:
+    """
+    Счетчики пакета: готово/всего, пропущено (resume), ошибки, документов в секунду,
+    среднее время на строку (скользящее по последним window строкам) и ETA.
+    callback(snapshot) вызывается не чаще max_rate раз в секунду (и всегда в конце),
+    snapshot() можно читать из любого потока.
+    """
+
+    def __init__(self, callback=None, max_rate=PROGRESS_RATE, window=PROGRESS_WINDOW):
+        self.callback = callback
+        self.interval = 1.0 / max_rate if max_rate else 0.0
+        self._lock = threading.Lock()
+        self._stamps = deque(maxlen=window)     # время готовности последних документов
+        self._latencies = deque(maxlen=window)  # время рендера последних строк
+        self.start()
+
+    def start(self, total=0):
+        with self._lock:
+            self.total = total
+            self.done = 0
+            self.skipped = 0
+            self.errors = 0
+            self.running = True
+            self._stamps.clear()
+            self._latencies.clear()
+            self._started = time.perf_counter()
+            self._last_emit = 0.0
+
+    def update(self, latency=None, skipped=False, error=False):
+        """Одна строка обработана: отрисована (latency - секунды рендера), пропущена или с ошибкой"""
+        now = time.perf_counter()
+        with self._lock:
+            self.done += 1
+            if skipped: self.skipped += 1
+            else: self._stamps.append(now)
+            if error: self.errors += 1
+            if latency is not None: self._latencies.append(latency)
+            due = now - self._last_emit >= self.interval
+            if due: self._last_emit = now
+        if due: self._emit()
+
+    def error(self):
+        """Ошибка вне учета строк (например, не удалось записать файл)"""
+        with self._lock:
+            self.errors += 1
+
+    def finish(self):
+        with self._lock:
+            self.running = False
+        self._emit()
+
+    def _emit(self):
+        if self.callback: self.callback(self.snapshot())
+
+    def snapshot(self):
+        with self._lock:
+            now = time.perf_counter()
+            total = max(self.total, self.done)
+            stamps = self._stamps
+            # Скорость по окну последних документов: пропущенные строки и старт не искажают оценку
+            if len(stamps) >= 2 and stamps[-1] > stamps[0]:
+                rate = (len(stamps) - 1) / (stamps[-1] - stamps[0])
+            elif stamps:
+                rate = len(stamps) / max(now - self._started, 1e-9)
+            else:
+                rate = 0.0
+            latency = sum(self._latencies) / len(self._latencies) if self._latencies else None
+            eta = (self.total - self.done) / rate if self.total and rate and self.running else None
+            return {
+                'done': self.done,
+                'total': total,
+                'skipped': self.skipped,
+                'errors': self.errors,
+                'rate': round(rate, 2),
+                'latency': round(latency, 4) if latency is not None else None,
+                'eta': round(max(eta, 0.0), 1) if eta is not None else None,
+                'elapsed': round(now - self._started, 1),
+                'running': self.running,
+            }
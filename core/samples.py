@@ -0,0 +1,126 @@
+import json
+import threading
+from PIL import Image
+from core.cache import LRUCache
+from core.imageserver import encode_frame
+from core.generator import _glyphs_bbox
+
+SAMPLE_TEXT = "Образец почерка Abc 123"
+SAMPLE_HEIGHT = 48         # Высота строки образца (px), крупные размеры рисуются уменьшенными
+SAMPLE_CACHE_BYTES = 64 * 1024 * 1024
+# Настройки по умолчанию (как в интерфейсе) - с ними образцы всех шрифтов готовятся заранее
+DEFAULT_SAMPLE_PARAMS = {'size': 50, 'color': '#1414A0', 'shakiness': 3, 'opacity': 5, 'kerning': 2,
+                         'height_variation': 2, 'width_variation': 2}
+# Старые имена параметров из static/js -> имена globals шаблона
+PARAM_ALIASES = {'ink': 'opacity', 'sizeVar': ('height_variation', 'width_variation')}
+
+
+def sample_globals(params):
+    """Параметры образца (globals шаблона или настройки static/js) -> globals шаблона"""
+    glo = {}
+    for k, v in params.items():
+        alias = PARAM_ALIASES.get(k, k)
+        for name in (alias if isinstance(alias, tuple) else (alias,)):
+            glo.setdefault(name, v)
+    # Образец - для глаз, а не для пакета: по умолчанию быстрый рендер одной трансформацией на символ
+    glo.setdefault('render_mode', 'fused')
+    return glo
+
+
+class SampleRenderer:
+    """
+    Образцы почерка для интерфейса: короткая строка тем же конвейером, что и документ
+    (_layout_line + _render_glyphs), в уменьшенном размере на белой полосе.
+    Готовые кадры (уже закодированные) лежат в LRU по шрифту и параметрам, повторный
+    показ - без рендера. Фоновый поток заранее рисует образцы всех шрифтов с последними
+    запрошенными параметрами, поэтому перебор шрифтов в списке не ждет рендера.
+    """
+
+    def __init__(self, gen, cache_bytes=SAMPLE_CACHE_BYTES):
+        self.gen = gen
+        self.cache = LRUCache(max_items=2048, max_bytes=cache_bytes, sizeof=lambda v: len(v[0]))
+        self._cond = threading.Condition()
+        self._warm = None   # (параметры без шрифта, шрифты) для фонового потока
+        self._warm_seq = 0
+        self._closed = False
+        self._thread = None
+
+    @staticmethod
+    def key(glo):
+        return json.dumps(glo, sort_keys=True, ensure_ascii=False, default=str)
+
+    def frame(self, params):
+        """Параметры -> (байты, mime) образца; из кэша или рендером в текущем потоке"""
+        glo = sample_globals(params)
+        key = self.key(glo)
+        frame = self.cache.get(key)
+        if frame is None:
+            frame = encode_frame(self.render(glo))
+            self.cache.put(key, frame)
+        return frame
+
+    def render(self, glo):
+        gen = self.gen
+        text = str(glo.pop('text', None) or SAMPLE_TEXT)
+        tpl = gen.compile(json.dumps({'globals': glo, 'zones': []}))
+        if not tpl.fonts: return Image.new('RGB', (1, 1), 'white')
+        doc = gen._begin_doc(tpl, {'ID': 'SAMPLE'}, 0)
+        size = doc['base_size']
+        scale = min(1.0, SAMPLE_HEIGHT / max(1, size))
+        doc['phys']['scale'] = scale
+        draw_size = max(1, int(round(size * scale)))
+        # Пул шрифтов как у зоны без своего шрифта
+        if tpl.font_mode == 'random': pool = list(tpl.active_pool)
+        elif tpl.font_mode in tpl.fonts: pool = [tpl.font_mode]
+        else: pool = doc['font_pool']
+
+        # Отступ, чтобы хвосты букв и сдвиги не уходили за край
+        pad = draw_size
+        glyphs = gen._layout_line(text, pool, draw_size, pad, pad, doc['phys'], doc['color'], doc['rng'])
+        box = _glyphs_bbox(glyphs, (1 << 16, 1 << 16))
+        if box is None: return Image.new('RGB', (1, 1), 'white')
+        layer = Image.new('RGBA', (box[2] - box[0], box[3] - box[1]), (255, 255, 255, 0))
+        gen._render_glyphs(layer, glyphs, doc['phys'], box[:2])
+        if tpl.ink_effects == 'layer': layer = gen._apply_ink(layer, doc, box[:2])
+        out = Image.new('RGBA', layer.size, (255, 255, 255, 255))
+        out.alpha_composite(layer)
+        return out.convert('RGB')
+
+    # --- фоновая подготовка ---
+
+    def prewarm(self, fonts, params=None):
+        """
+        Поставить в фон образцы шрифтов fonts с параметрами params (шрифт в params не важен).
+        Новый вызов заменяет незаконченный прежний.
+        """
+        base = dict(params if params is not None else DEFAULT_SAMPLE_PARAMS)
+        base.pop('font', None)
+        with self._cond:
+            self._warm_seq += 1
+            self._warm = (base, list(fonts))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._warm_loop, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _warm_loop(self):
+        while True:
+            with self._cond:
+                while self._warm is None and not self._closed:
+                    self._cond.wait()
+                if self._closed: return
+                seq = self._warm_seq
+                base, fonts = self._warm
+                self._warm = None
+            for font in fonts:
+                # Пришли новые параметры (или закрытие) - текущий проход больше не нужен
+                if self._warm_seq != seq or self._closed: break
+                try:
+                    self.frame(dict(base, font=font))
+                except Exception as e:
+                    print(f"Err sample {font}: {e}")
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
@@ -0,0 +1,114 @@
+import threading
+import multiprocessing as mp
+from collections import deque
+from contextlib import contextmanager
+from core.control import JobControl, JobCancelled
+from core.generator import Generator
+
+
+class BatchJob:
+    """
+    Пакет в очереди планировщика. У каждого пакета свой Generator (кэши, замеры, флаги)
+    и свой JobControl, поэтому превью и другие пакеты не меняют его состояние.
+    state: queued -> running -> done | cancelled (пауза видна в paused).
+    """
+
+    def __init__(self, args, kwargs, control):
+        self.args = args
+        self.kwargs = kwargs
+        self.control = control
+        self.gen = None
+        self.state = 'queued'
+        self.finished = threading.Event()
+
+    @property
+    def paused(self): return self.control.paused
+
+    def pause(self): self.control.pause()
+
+    def resume(self): self.control.resume()
+
+    def cancel(self): self.control.cancel()
+
+    def wait(self, timeout=None): return self.finished.wait(timeout)
+
+
+class Scheduler:
+    """
+    Задания рендера интерфейса:
+    - пакеты идут по одному в своем потоке, каждый со своим Generator (см. BatchJob);
+    - превью и образцы интерактивные: выполняются сразу в потоке запроса (interactive()),
+      а пакет на это время ждет на ближайшем символе - и в процессах пула тоже,
+      поэтому превью во время генерации не делит процессор с пакетом;
+    - pause/resume/cancel срабатывают сразу, а не между строками таблицы.
+    """
+
+    def __init__(self, make_gen=Generator):
+        self.make_gen = make_gen
+        # 1 - интерактивных заданий нет, пакетам можно работать (общий для всех JobControl)
+        self.gate = mp.RawValue('b', 1)
+        self.current = None
+        self._interactive = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    @contextmanager
+    def interactive(self):
+        """Интерактивное задание: пока оно идет, пакеты ждут"""
+        with self._cond:
+            self._interactive += 1
+            self.gate.value = 0
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._interactive -= 1
+                if not self._interactive: self.gate.value = 1
+
+    def submit(self, *args, **kwargs):
+        """Ставит пакет в очередь (аргументы как у Generator.batch) и возвращает BatchJob"""
+        job = BatchJob(args, kwargs, JobControl(self.gate))
+        with self._cond:
+            self._queue.append(job)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+        return job
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                job = self.current = self._queue.popleft()
+            # Отмененный в очереди пакет тоже проходит через batch: он сразу остановится,
+            # но прогресс и cb_done отработают как обычно
+            job.state = 'running'
+            job.gen = self.make_gen()
+            try:
+                job.gen.batch(*job.args, control=job.control, **job.kwargs)
+            except JobCancelled:
+                pass
+            except Exception as e:
+                print(f"Err batch: {e}")
+            job.state = 'cancelled' if job.control.cancelled else 'done'
+            with self._cond:
+                self.current = None
+            job.finished.set()
+
+    def jobs(self):
+        """Текущий пакет и очередь"""
+        with self._cond:
+            return ([self.current] if self.current else []) + list(self._queue)
+
+    def pause(self):
+        for job in self.jobs(): job.pause()
+
+    def resume(self):
+        for job in self.jobs(): job.resume()
+
+    def cancel(self):
+        """Отменяет текущий пакет и все ожидающие"""
+        for job in self.jobs(): job.cancel()
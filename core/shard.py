@@ -0,0 +1,128 @@
+import os
+import json
+import glob
+import hashlib
+from dataclasses import dataclass
+from core.manifest import MANIFEST_NAME, row_digest, record_path
+from core.output import OutputOptions, doc_name
+from core.sources import iter_rows, count_rows
+
+SHARD_MODES = ('hash', 'range')
+
+
+@dataclass(frozen=True)
+class Shard:
+    """
+    Часть пакета для одной машины: index из count (index с нуля).
+    mode='hash' - строка попадает в шард по стабильному хешу seed key (ID + seed проекта),
+    mode='range' - шард берет непрерывный диапазон строк (нужно знать число строк).
+    Имена файлов (doc_N) считаются от номера строки во всей таблице, поэтому шарды не пересекаются,
+    а вместе дают ровно тот же набор файлов, что и запуск на одной машине.
+    """
+    index: int
+    count: int
+    mode: str = 'hash'
+
+    def __post_init__(self):
+        if self.count < 1 or not 0 <= self.index < self.count:
+            raise ValueError(f"Неверный шард: {self.index + 1}/{self.count}")
+        if self.mode not in SHARD_MODES:
+            raise ValueError(f"Неизвестный режим шардирования: {self.mode}")
+
+    @classmethod
+    def parse(cls, spec, mode='hash'):
+        """'2/8' -> второй шард из восьми (в строке номер с единицы)"""
+        try:
+            i, n = (int(p) for p in str(spec).split('/'))
+        except ValueError:
+            raise ValueError(f"Шард задается как i/N, а не {spec!r}")
+        return cls(i - 1, n, mode)
+
+    @property
+    def manifest_name(self):
+        return f"manifest.shard-{self.index + 1}-of-{self.count}.jsonl"
+
+    @property
+    def index_name(self):
+        return f"index.shard-{self.index + 1}-of-{self.count}.jsonl"
+
+    @property
+    def prefix(self):
+        """Начало имен контейнеров (core.sinks), чтобы у шардов они не совпадали"""
+        return f"docs.shard-{self.index + 1}-of-{self.count}"
+
+    def bounds(self, total):
+        """
+        Диапазон номеров строк [start, stop) для mode='range'.
+        Последний шард забирает и хвост, если строк оказалось больше, чем total.
+        """
+        stop = total * (self.index + 1) // self.count if self.index < self.count - 1 else float('inf')
+        return total * self.index // self.count, stop
+
+    def contains(self, counter, seed_key, total=None):
+        if self.mode == 'range':
+            start, stop = self.bounds(total)
+            return start <= counter < stop
+        h = int(hashlib.md5(seed_key.encode('utf-8')).hexdigest()[:8], 16)
+        return h % self.count == self.index
+
+
+def total_rows(rows):
+    """Число строк таблицы; если источник его не знает (CSV) - одним проходом по колонке ID"""
+    total = count_rows(rows)
+    if total is None: total = sum(1 for _ in iter_rows(rows, []))
+    return total
+
+
+def expected_docs(gen, bg_list, rows, tpl, output=None, sink='files'):
+    """Для каждой строки таблицы: (имя файла, seed key, хеш входов) - как их посчитает batch"""
+    output = output or OutputOptions()
+    columns = tpl.columns()
+    for counter, row in enumerate(iter_rows(rows, columns)):
+        bg_path = bg_list[counter % len(bg_list)]
+        key = gen._seed_key(row, counter, tpl.seed)
+        yield doc_name(counter, output), key, row_digest(key, row, columns, bg_path, tpl, output, sink)
+
+
+def merge_shards(gen, folder, bg_list, rows, template, output=None, sink='files'):
+    """
+    Сводит манифесты шардов в папке (файлы шардов уже собраны в одну папку) в общий манифест
+    и проверяет покрытие: для каждой строки таблицы должен быть файл с записью,
+    совпадающей по seed key и хешу входов с тем, что нарисовал бы один запуск
+    (sink - вид синка core.sinks, с которым рендерились шарды).
+    Возвращает отчет: total, ok, missing (строки без документа), stale (документ от других входов).
+    Общий manifest.jsonl пишется только из совпавших записей, так что обычный запуск с resume
+    после слияния дорисует ровно недостающее.
+    """
+    tpl = gen.compile(template)
+    found = {}
+    for path in sorted(glob.glob(os.path.join(folder, "manifest*.jsonl"))):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    found.setdefault(rec['file'], []).append(rec)
+                except (ValueError, KeyError):
+                    continue
+
+    report = {'total': 0, 'ok': 0, 'missing': [], 'stale': []}
+    good = []
+    for file_name, key, digest in expected_docs(gen, bg_list, rows, tpl, output, sink):
+        report['total'] += 1
+        recs = found.get(file_name, [])
+        match = next((r for r in recs if r.get('key') == key and r.get('hash') == digest), None)
+        exists = os.path.exists(os.path.join(folder, record_path(match) if match else file_name))
+        if match and exists:
+            report['ok'] += 1
+            good.append(match)
+        elif exists:
+            report['stale'].append(file_name)
+        else:
+            report['missing'].append(file_name)
+
+    path = os.path.join(folder, MANIFEST_NAME)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        for rec in good:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    os.replace(path + ".tmp", path)
+    return report
@@ -0,0 +1,278 @@
+import io
+import os
+import re
+import json
+import time
+import tarfile
+import zipfile
+import threading
+from dataclasses import replace
+from PIL import Image, TiffImagePlugin
+from core.output import OutputOptions
+
+INDEX_NAME = "index.jsonl"
+PDF_DPI = 300  # Если в JPEG не записано разрешение
+
+
+class FileSink:
+    """
+    Куда пишутся готовые документы. По умолчанию - отдельные файлы doc_N в папке вывода.
+    Синк потокобезопасен (пишут несколько потоков OutputStage) и ничего не копит в памяти:
+    каждый документ сразу уходит на диск.
+    write() возвращает положение документа - словарь {'path': путь относительно папки вывода,
+    плюс 'member' или 'page' для контейнеров}; оно попадает в манифест и в индекс.
+    output - настройки вывода из запуска (по ним имена doc_N), options - в каком формате
+    кодировать документы для этого синка (у TIFF и PDF свой формат страниц).
+    """
+    kind = 'files'
+    default_bundle = 0
+
+    def __init__(self, folder, options=None, bundle=None, prefix="docs", index_name=INDEX_NAME):
+        self.folder = folder
+        self.output = self.options = options or OutputOptions()
+        self.bundle = self.default_bundle if bundle is None else bundle
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._index = open(os.path.join(folder, index_name), 'a', encoding='utf-8')
+
+    def write(self, name, counter, data):
+        with open(os.path.join(self.folder, name), 'wb') as f:
+            f.write(data)
+        return {'path': name}
+
+    def exists(self, loc):
+        return os.path.exists(os.path.join(self.folder, loc['path']))
+
+    def log(self, row_id, counter, name, loc):
+        """Строка индекса: ID строки таблицы -> где лежит ее документ (последняя запись по строке главная)"""
+        rec = {'id': row_id, 'row': counter + 1, 'file': name}
+        rec.update(loc)
+        with self._lock:
+            self._index.write(json.dumps(rec, ensure_ascii=False, default=str) + "\n")
+            self._index.flush()
+
+    def close(self):
+        with self._lock:
+            self._index.close()
+
+
+class DirSink(FileSink):
+    """Файлы по подпапкам: в подпапке bundle документов подряд (00000/, 00001/, ...)"""
+    kind = 'dirs'
+    default_bundle = 1000
+
+    def __init__(self, folder, options=None, bundle=None, prefix="docs", index_name=INDEX_NAME):
+        super().__init__(folder, options, bundle, prefix, index_name)
+        self._made = set()
+
+    def write(self, name, counter, data):
+        sub = f"{counter // max(1, self.bundle):05d}"
+        if sub not in self._made:
+            os.makedirs(os.path.join(self.folder, sub), exist_ok=True)
+            self._made.add(sub)
+        return super().write(f"{sub}/{name}", counter, data)
+
+
+class ContainerSink(FileSink):
+    """
+    Документы пачками в файлы-контейнеры prefix-0001.ext, prefix-0002.ext, ... (bundle штук
+    в контейнере, 0 - без ограничения). Контейнер пишется потоково в .part и получает
+    свое имя при закрытии, поэтому после падения недописанный контейнер не считается готовым
+    и его документы перерисуются (сам .part удаляется при следующем запуске).
+    Номера продолжаются после уже лежащих в папке контейнеров.
+    """
+    ext = ''
+
+    def __init__(self, folder, options=None, bundle=None, prefix="docs", index_name=INDEX_NAME):
+        super().__init__(folder, options, bundle, prefix, index_name)
+        self._number = self._last_number()
+        self._current = None  # (имя контейнера, открытый писатель)
+        self._count = 0
+
+    def _last_number(self):
+        pattern = re.compile(re.escape(self.prefix) + r"-(\d+)" + re.escape(self.ext) + r"(\.part)?$")
+        numbers = []
+        for name in os.listdir(self.folder):
+            m = pattern.match(name)
+            if not m: continue
+            # Недописанный контейнер удаляем, но его номер не занимаем заново:
+            # записи манифеста от прерванного запуска не должны указать на новый файл
+            if m.group(2): os.remove(os.path.join(self.folder, name))
+            numbers.append(int(m.group(1)))
+        return max(numbers, default=0)
+
+    def write(self, name, counter, data):
+        with self._lock:
+            if self._current is None or (self.bundle and self._count >= self.bundle):
+                self._finish()
+                self._number += 1
+                path = f"{self.prefix}-{self._number:04d}{self.ext}"
+                self._current = (path, self._open(os.path.join(self.folder, path + ".part")))
+                self._count = 0
+            path, writer = self._current
+            loc = {'path': path}
+            loc.update(self._append(writer, name, data, self._count))
+            self._count += 1
+            return loc
+
+    def _finish(self):
+        if self._current is None: return
+        path, writer = self._current
+        self._close(writer)
+        full = os.path.join(self.folder, path)
+        os.replace(full + ".part", full)
+        self._current = None
+
+    def close(self):
+        with self._lock:
+            self._finish()
+        super().close()
+
+    # Для конкретного формата
+    def _open(self, path): raise NotImplementedError
+    def _append(self, writer, name, data, number): raise NotImplementedError
+    def _close(self, writer): writer.close()
+
+
+class ZipSink(ContainerSink):
+    """ZIP без сжатия: JPEG/PNG/WebP уже сжаты, повторное сжатие только тратит время"""
+    kind = 'zip'
+    ext = '.zip'
+
+    def _open(self, path):
+        return zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED, allowZip64=True)
+
+    def _append(self, writer, name, data, number):
+        writer.writestr(name, data)
+        return {'member': name}
+
+
+class TarSink(ContainerSink):
+    kind = 'tar'
+    ext = '.tar'
+
+    def _open(self, path):
+        return tarfile.open(path, 'w')
+
+    def _append(self, writer, name, data, number):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        writer.addfile(info, io.BytesIO(data))
+        return {'member': name}
+
+
+class TiffSink(ContainerSink):
+    """
+    Многостраничный TIFF, bundle документов в файле. Страницы кодируются в TIFF (со сжатием JPEG,
+    lossless - Deflate) еще в потоках кодирования, сюда приходят готовые и только дописываются.
+    """
+    kind = 'tiff'
+    ext = '.tif'
+    default_bundle = 100
+
+    def __init__(self, folder, options=None, bundle=None, prefix="docs", index_name=INDEX_NAME):
+        super().__init__(folder, options, bundle, prefix, index_name)
+        self.options = replace(self.output, fmt='tiff')
+
+    def _open(self, path):
+        return TiffImagePlugin.AppendingTiffWriter(path, new=True)
+
+    def _append(self, writer, name, data, number):
+        writer.write(data)
+        writer.newFrame()
+        return {'page': number + 1}
+
+
+class PdfSink(ContainerSink):
+    """PDF, bundle документов в файле, страница на документ. JPEG кладется в PDF как есть (DCTDecode)"""
+    kind = 'pdf'
+    ext = '.pdf'
+    default_bundle = 100
+
+    def __init__(self, folder, options=None, bundle=None, prefix="docs", index_name=INDEX_NAME):
+        super().__init__(folder, options, bundle, prefix, index_name)
+        if self.output.pil_format != 'JPEG': self.options = replace(self.output, fmt='jpg')
+
+    def _open(self, path):
+        return PdfStream(path)
+
+    def _append(self, writer, name, data, number):
+        writer.add_jpeg(data)
+        return {'page': number + 1}
+
+
+class PdfStream:
+    """
+    Минимальный потоковый PDF из JPEG-страниц: объекты страниц пишутся сразу,
+    в памяти только смещения объектов; дерево страниц и xref - при закрытии.
+    """
+    COLORSPACES = {'RGB': '/DeviceRGB', 'L': '/DeviceGray', 'CMYK': '/DeviceCMYK'}
+
+    def __init__(self, path):
+        self._f = open(path, 'wb')
+        self._offsets = {}
+        self._next = 3  # 1 - каталог, 2 - дерево страниц (пишутся в конце)
+        self._pages = []
+        self._f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _obj(self, body, stream=None, num=None):
+        if num is None:
+            num = self._next
+            self._next += 1
+        self._offsets[num] = self._f.tell()
+        self._f.write(f"{num} 0 obj\n".encode('ascii') + body.encode('ascii'))
+        if stream is not None:
+            self._f.write(b"\nstream\n" + stream + b"\nendstream")
+        self._f.write(b"\nendobj\n")
+        return num
+
+    def add_jpeg(self, data):
+        with Image.open(io.BytesIO(data)) as im:
+            w, h = im.size
+            mode = im.mode
+            dpi = im.info.get('dpi')
+        dpi_x, dpi_y = dpi if dpi and dpi[0] > 1 and dpi[1] > 1 else (PDF_DPI, PDF_DPI)
+        pw, ph = w * 72.0 / dpi_x, h * 72.0 / dpi_y
+        decode = " /Decode [1 0 1 0 1 0 1 0]" if mode == 'CMYK' else ""  # Adobe CMYK JPEG инвертирован
+        image = self._obj(f"<< /Type /XObject /Subtype /Image /Width {w} /Height {h} "
+                          f"/ColorSpace {self.COLORSPACES.get(mode, '/DeviceRGB')} /BitsPerComponent 8"
+                          f"{decode} /Filter /DCTDecode /Length {len(data)} >>", data)
+        content = f"q {pw:.2f} 0 0 {ph:.2f} 0 0 cm /Im0 Do Q".encode('ascii')
+        contents = self._obj(f"<< /Length {len(content)} >>", content)
+        self._pages.append(self._obj(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {pw:.2f} {ph:.2f}] "
+            f"/Resources << /XObject << /Im0 {image} 0 R >> >> /Contents {contents} 0 R >>"))
+
+    def close(self):
+        kids = " ".join(f"{n} 0 R" for n in self._pages)
+        self._obj(f"<< /Type /Pages /Kids [{kids}] /Count {len(self._pages)} >>", num=2)
+        self._obj("<< /Type /Catalog /Pages 2 0 R >>", num=1)
+        xref = self._f.tell()
+        size = self._next
+        lines = ["xref", f"0 {size}", "0000000000 65535 f "]
+        lines += [f"{self._offsets[n]:010d} 00000 n " for n in range(1, size)]
+        lines += ["trailer", f"<< /Size {size} /Root 1 0 R >>", "startxref", str(xref), "%%EOF", ""]
+        self._f.write("\n".join(lines).encode('ascii'))
+        self._f.close()
+
+
+SINKS = {cls.kind: cls for cls in (FileSink, DirSink, ZipSink, TarSink, TiffSink, PdfSink)}
+
+
+def make_sink(spec, folder, options=None, prefix="docs", index_name=INDEX_NAME):
+    """
+    'zip', 'tar:5000', 'tiff:50', 'pdf', 'dirs:1000', 'files' (или готовый синк) -> синк.
+    Число после двоеточия - документов в контейнере (в подпапке для dirs).
+    """
+    if isinstance(spec, FileSink): return spec
+    kind, _, bundle = (spec or 'files').partition(':')
+    cls = SINKS.get(kind.lower())
+    if cls is None:
+        raise ValueError(f"Неизвестный вывод: {kind} (есть: {', '.join(SINKS)})")
+    try:
+        bundle = int(bundle) if bundle else None
+    except ValueError:
+        raise ValueError(f"Число документов в пачке - целое, а не {bundle!r}")
+    return cls(folder, options, bundle, prefix, index_name)
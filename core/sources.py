@@ -0,0 +1,239 @@
+import os
+import csv
+import queue
+import threading
+
+PREFETCH_ROWS = 256 # Сколько строк читаем вперед, пока идет рендер
+
+
+def cell_to_str(value):
+    """
+    Значение ячейки -> строка так же, как pd.read_excel(dtype=str).fillna(""):
+    пусто -> "", целые числа без ".0", даты через str().
+    От этого зависит seed строки (ID), поэтому совпадение важно.
+    """
+    if value is None: return ""
+    if isinstance(value, bool): return str(value)
+    if isinstance(value, float):
+        if value != value: return ""  # NaN
+        if value.is_integer(): return str(int(value))
+    return str(value)
+
+
+def make_header(raw):
+    """Заголовки как у pandas: пустые -> 'Unnamed: N', повторы -> 'name.1', 'name.2'..."""
+    header, seen = [], {}
+    for i, h in enumerate(raw):
+        name = cell_to_str(h) or f"Unnamed: {i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        header.append(name)
+    return header
+
+
+def is_id_column(name):
+    return str(name).strip().lower() == 'id'
+
+
+class RowSource:
+    """
+    Потоковый источник строк таблицы: строки отдаются по одной (dict колонка -> str),
+    файл целиком в память не грузится. columns - заголовок, total - число строк, если известно.
+    """
+    path = None
+    total = None
+
+    def __init__(self, path):
+        self.path = path
+        self.columns = self._read_header()
+
+    def _read_header(self): raise NotImplementedError
+
+    def _iter_raw(self, indexes):
+        """Сырые строки (списки значений) только для колонок indexes, без заголовка"""
+        raise NotImplementedError
+
+    def iter_rows(self, columns=None):
+        """
+        Строки как dict. Если columns задан - читаем только эти колонки и колонку ID
+        (она нужна для seed). Пустые строки в середине сохраняются, хвостовые отбрасываются (как pandas).
+        """
+        if columns is None:
+            names = list(self.columns)
+        else:
+            wanted = set(columns)
+            names = [c for c in self.columns if c in wanted or is_id_column(c)]
+        indexes = [self.columns.index(c) for c in names]
+
+        empty_run = 0
+        for raw in self._iter_raw(indexes):
+            values = [cell_to_str(v) for v in raw]
+            if not any(values):
+                empty_run += 1
+                continue
+            for _ in range(empty_run): yield dict.fromkeys(names, "")
+            empty_run = 0
+            yield dict(zip(names, values))
+
+    def __iter__(self): return self.iter_rows()
+
+    def first_row(self):
+        return next(iter(self.iter_rows()), None)
+
+
+class ExcelSource(RowSource):
+    """xlsx через openpyxl в режиме read_only (строки читаются из zip потоком)"""
+
+    def _open(self):
+        import openpyxl
+        wb = openpyxl.load_workbook(self.path, read_only=True, data_only=True)
+        return wb, wb.active
+
+    def _read_header(self):
+        wb, ws = self._open()
+        try:
+            first = next(ws.iter_rows(max_row=1, values_only=True), ())
+            # max_row в read_only берется из размеров листа и может отсутствовать
+            if ws.max_row: self.total = max(0, ws.max_row - 1)
+            return make_header(first)
+        finally:
+            wb.close()
+
+    def _iter_raw(self, indexes):
+        wb, ws = self._open()
+        try:
+            width = len(self.columns)
+            for raw in ws.iter_rows(min_row=2, max_col=width, values_only=True):
+                yield [raw[i] if i < len(raw) else None for i in indexes]
+        finally:
+            wb.close()
+
+
+class CsvSource(RowSource):
+    """CSV (utf-8, разделитель определяется автоматически)"""
+
+    def _open(self):
+        f = open(self.path, 'r', encoding='utf-8-sig', newline='')
+        sample = f.read(64 * 1024)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t|')
+        except csv.Error:
+            dialect = csv.excel
+        return f, csv.reader(f, dialect)
+
+    def _read_header(self):
+        f, reader = self._open()
+        with f:
+            return make_header(next(reader, []))
+
+    def _iter_raw(self, indexes):
+        f, reader = self._open()
+        with f:
+            next(reader, None)
+            for raw in reader:
+                yield [raw[i] if i < len(raw) and raw[i] != "" else None for i in indexes]
+
+
+class ParquetSource(RowSource):
+    """Parquet через pyarrow (нужен только для этого формата), читается батчами по колонкам"""
+
+    def _file(self):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Для Parquet нужен пакет pyarrow (pip install pyarrow)")
+        return pq.ParquetFile(self.path)
+
+    def _read_header(self):
+        pf = self._file()
+        self.total = pf.metadata.num_rows
+        return make_header(pf.schema_arrow.names)
+
+    def _iter_raw(self, indexes):
+        pf = self._file()
+        raw_names = pf.schema_arrow.names
+        cols = [raw_names[i] for i in indexes]
+        for batch in pf.iter_batches(batch_size=4096, columns=cols):
+            data = batch.to_pydict()
+            for j in range(batch.num_rows):
+                yield [data[c][j] for c in cols]
+
+
+SOURCES = {
+    '.xlsx': ExcelSource,
+    '.xlsm': ExcelSource,
+    '.csv': CsvSource,
+    '.tsv': CsvSource,
+    '.txt': CsvSource,
+    '.parquet': ParquetSource,
+    '.pq': ParquetSource,
+}
+
+
+def open_rows(path):
+    """Открывает таблицу по расширению файла. Читается только заголовок."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in SOURCES:
+        raise ValueError(f"Неподдерживаемый формат таблицы: {ext}")
+    return SOURCES[ext](path)
+
+
+def iter_rows(rows, columns=None):
+    """
+    Приводит источник к итератору dict-строк:
+    RowSource (потоково, только нужные колонки), pandas.DataFrame или любой итерируемый набор dict.
+    """
+    if isinstance(rows, RowSource):
+        return rows.iter_rows(columns)
+    if hasattr(rows, 'iterrows'):
+        return (row.to_dict() for idx, row in rows.iterrows())
+    return iter(rows)
+
+
+def count_rows(rows):
+    """Число строк, если его можно узнать без чтения файла, иначе None"""
+    if isinstance(rows, RowSource): return rows.total
+    try: return len(rows)
+    except TypeError: return None
+
+
+def prefetch(iterable, size=PREFETCH_ROWS):
+    """
+    Читает источник в отдельном потоке на size элементов вперед.
+    Рендер первых строк начинается сразу, пока остальная таблица еще читается.
+    """
+    q = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # Не блокируемся навсегда, если рендер уже остановлен и очередь никто не читает
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def reader():
+        try:
+            for item in iterable:
+                if not put(item): return
+            put(done)
+        except Exception as e:
+            put(e)
+
+    threading.Thread(target=reader, daemon=True).start()
+    try:
+        while True:
+            item = q.get()
+            if item is done: return
+            if isinstance(item, Exception): raise item
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,231 @@
+import json
+import hashlib
+from dataclasses import dataclass, replace
+
+# Параметры "физики" документа в порядке, в котором для них тянется rng (важно для повторяемости)
+PHYS_PARAMS = (
+    ('shakiness', 0),
+    ('opacity', 8),
+    ('kerning', 0),
+    ('slant', 0),
+    ('blur', 0),
+    ('height_variation', 0),
+    ('width_variation', 0),
+    ('distortion', 0),
+)
+
+
+class TemplateError(ValueError):
+    """Шаблон (JSON из UI.getConfigJSON / getConfig) не прошел проверку"""
+
+
+@dataclass(frozen=True)
+class CompiledZone:
+    x: float
+    y: float
+    width: float
+    height: float
+    size: int            # 0 -> размер документа
+    source_type: str     # 'excel' или 'text'
+    content: str         # имя колонки или сам текст
+    font_pool: tuple     # пустой -> шрифт документа (режим random_per_doc)
+
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    """
+    Шаблон, разобранный один раз на весь пакет: JSON, шрифты, цвета и диапазоны
+    уже проверены и приведены к нужным типам. Неизменяемый, поэтому его можно
+    безопасно отдавать в потоки и процессы.
+    Диапазоны хранятся как float или (min, max).
+    """
+    zones: tuple
+    fonts: tuple             # доступные шрифты (get_fonts на момент компиляции)
+    font_mode: str           # 'random', 'random_per_doc' или имя шрифта
+    active_pool: tuple       # шрифты с весом > 0 (или первый доступный)
+    weighted_fonts: tuple    # кандидаты для random_per_doc
+    font_weights: tuple
+    seed: str
+    base_rgb: tuple
+    size: object
+    color_var: object
+    phys: tuple              # ((имя, диапазон), ...) в порядке PHYS_PARAMS
+    render_mode: str
+    fingerprint: str         # md5 исходного JSON и списка шрифтов (для манифеста вывода)
+    scale: float = 1.0       # масштаб рендера относительно координат шаблона (фон тоже масштабируется)
+    ink_effects: str = 'glyph'  # 'glyph' - блюр на каждый символ, 'layer' - эффекты чернил на слой (core.ink)
+    # Рабочее разрешение документа (None - разрешение фона): фон уменьшается до target_dpi
+    # (исходное - из файла, иначе source_dpi) и/или до max_dim по большей стороне, см. resolution_scale
+    target_dpi: float = None
+    source_dpi: float = None
+    max_dim: int = None
+
+    def scaled(self, factor):
+        """
+        Тот же шаблон, но рендер в factor раз меньше/больше. Координаты зон и размеры шрифтов
+        остаются в единицах шаблона, переносы строк и случайные параметры не меняются.
+        """
+        return replace(self, scale=self.scale * factor)
+
+    def resolution_scale(self, size, dpi=None):
+        """
+        Во сколько раз уменьшить рендер для фона размера size с разрешением dpi (из файла, может не быть),
+        чтобы получить target_dpi и не больше max_dim. Не больше 1: фон никогда не увеличивается.
+        """
+        factor = 1.0
+        if self.target_dpi:
+            src = dpi[0] if dpi and dpi[0] > 1 else self.source_dpi
+            if src: factor = min(factor, self.target_dpi / src)
+        if self.max_dim:
+            factor = min(factor, self.max_dim / max(size))
+        return factor
+
+    def columns(self):
+        """Колонки таблицы, на которые ссылаются зоны (остальные можно не читать)"""
+        return sorted({z.content for z in self.zones if z.source_type != 'text'})
+
+    def row_template(self):
+        """Строка-заглушка для превью без Excel: в каждую зону подставляется имя колонки"""
+        row = {z.content: z.content for z in self.zones}
+        # Добавим фейковый ID для превью, чтобы оно не скакало при каждом клике
+        row['ID'] = 'PREVIEW'
+        return row
+
+
+def parse_positive(value, name):
+    """Необязательное положительное число (None/0/'' - не задано)"""
+    if value in (None, '', 0): return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        number = 0
+    if number <= 0:
+        raise TemplateError(f"Неверное значение параметра '{name}': {value!r}")
+    return number
+
+
+def hex_to_rgb(hex_color):
+    hex_color = str(hex_color).lstrip('#')
+    if len(hex_color) != 6:
+        raise TemplateError(f"Неверный цвет: #{hex_color}")
+    try:
+        return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+    except ValueError:
+        raise TemplateError(f"Неверный цвет: #{hex_color}")
+
+
+def parse_range(param, name):
+    """{min, max} -> (min, max), число -> float"""
+    try:
+        if isinstance(param, dict) and 'min' in param and 'max' in param:
+            return (float(param['min']), float(param['max']))
+        return float(param)
+    except (TypeError, ValueError):
+        raise TemplateError(f"Неверное значение параметра '{name}': {param!r}")
+
+
+def project_to_config(project):
+    """
+    Проект, сохраненный из интерфейса (saveProject: zones с x, y, w, h и settings),
+    -> JSON шаблона, как его собирает getConfig(). Уже готовый шаблон возвращается как есть.
+    """
+    if isinstance(project, str):
+        try:
+            project = json.loads(project)
+        except ValueError as e:
+            raise TemplateError(f"Шаблон не является JSON: {e}")
+    if not isinstance(project, dict) or 'zones' not in project:
+        raise TemplateError("В шаблоне нет 'zones'")
+    zones = []
+    for i, z in enumerate(project['zones']):
+        if 'settings' not in z:
+            zones.append(z)
+            continue
+        st = z.get('settings') or {}
+        try:
+            # parseInt(style.left) в интерфейсе отбрасывает дробную часть
+            zones.append({
+                'sourceType': st.get('sourceType') or 'excel',
+                'content': st.get('content'),
+                'font': st.get('font'),
+                'size': st.get('size'),
+                'x': int(float(z['x'])), 'y': int(float(z['y'])),
+                'width': int(float(z['w'])), 'height': int(float(z['h'])),
+            })
+        except (KeyError, TypeError, ValueError) as e:
+            raise TemplateError(f"Зона {i + 1}: неверные параметры ({e})")
+    return {'globals': project.get('globals') or {}, 'zones': zones}
+
+
+def compile_template(config, fonts):
+    """
+    Превращает JSON шаблона (строку или dict) в CompiledTemplate.
+    fonts - список доступных шрифтов (Generator.get_fonts()).
+    """
+    if isinstance(config, CompiledTemplate): return config
+    if isinstance(config, str):
+        try:
+            config = json.loads(config)
+        except ValueError as e:
+            raise TemplateError(f"Шаблон не является JSON: {e}")
+    if not isinstance(config, dict) or 'globals' not in config or 'zones' not in config:
+        raise TemplateError("В шаблоне нет 'globals' или 'zones'")
+
+    glo = config['globals']
+    fonts = tuple(fonts)
+    fonts_cfg = glo.get('fonts_config') or {}
+    font_mode = glo.get('font', 'random')
+
+    active_pool = tuple(f for f, w in fonts_cfg.items() if w > 0)
+    if not active_pool and fonts: active_pool = (fonts[0],)
+
+    # Кандидаты для 'random_per_doc' с весами (вес по умолчанию 5)
+    weighted, weights = [], []
+    for f in fonts:
+        w = fonts_cfg.get(f, 5)
+        if w > 0:
+            weighted.append(f)
+            weights.append(w)
+
+    zones = []
+    for i, z in enumerate(config['zones']):
+        try:
+            if z.get('font') and z['font'] in fonts:
+                pool = (z['font'],)
+            elif font_mode == 'random':
+                pool = active_pool
+            elif font_mode == 'random_per_doc':
+                pool = ()
+            else:
+                main_f = font_mode if font_mode in fonts else (fonts[0] if fonts else None)
+                pool = (main_f,) if main_f else ()
+            zones.append(CompiledZone(
+                x=float(z['x']), y=float(z['y']),
+                width=float(z['width']), height=float(z['height']),
+                size=int(z.get('size') or 0),
+                source_type=z.get('sourceType', 'excel'), # excel по умолчанию
+                content=str(z.get('content', '') or ''),
+                font_pool=pool,
+            ))
+        except (KeyError, TypeError, ValueError) as e:
+            raise TemplateError(f"Зона {i + 1}: неверные параметры ({e})")
+
+    return CompiledTemplate(
+        zones=tuple(zones),
+        fonts=fonts,
+        font_mode=font_mode,
+        active_pool=active_pool,
+        weighted_fonts=tuple(weighted),
+        font_weights=tuple(weights),
+        seed=str(glo.get('seed', 'default')),
+        base_rgb=hex_to_rgb(glo.get('color', '#000000')),
+        size=parse_range(glo.get('size', 20), 'size'),
+        color_var=parse_range(glo.get('color_var', 0), 'color_var'),
+        phys=tuple((name, parse_range(glo.get(name, default), name)) for name, default in PHYS_PARAMS),
+        render_mode=glo.get('render_mode', 'classic'),
+        ink_effects=glo.get('ink_effects', 'glyph'),
+        target_dpi=parse_positive(glo.get('target_dpi'), 'target_dpi'),
+        source_dpi=parse_positive(glo.get('source_dpi'), 'source_dpi'),
+        max_dim=parse_positive(glo.get('max_dim'), 'max_dim'),
+        fingerprint=hashlib.md5(json.dumps([config, fonts], sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest(),
+    )
@@ -24,6 +24,13 @@ def get_external_path(folder_name):
     
     return os.path.join(base_path, folder_name)
 
+BACKGROUND_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+def list_backgrounds(folder):
+    """Картинки-фоны в папке (без учета регистра расширения), отсортированные по имени"""
+    return sorted(os.path.join(folder, f) for f in os.listdir(folder)
+                  if f.lower().endswith(BACKGROUND_EXTS) and os.path.isfile(os.path.join(folder, f)))
+
 def image_to_base64(path):
     try:
         with open(path, "rb") as image_file:
@@ -57,11 +64,11 @@ def wrap_text(text, font, max_width):
         lines.append(current_line)
     return lines
 
-def vary_color(rgb, variance=20):
+def vary_color(rgb, variance=20, rng=random):
     """Добавляет шум в цвет для реализма"""
     r, g, b = rgb
     return (
-        max(0, min(255, r + random.randint(-variance, variance))),
-        max(0, min(255, g + random.randint(-variance, variance))),
-        max(0, min(255, b + random.randint(-variance, variance)))
+        max(0, min(255, r + rng.randint(-variance, variance))),
+        max(0, min(255, g + rng.randint(-variance, variance))),
+        max(0, min(255, b + rng.randint(-variance, variance)))
     )
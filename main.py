@@ -1,6 +1,7 @@
 import webview
 import os
 import sys
+import multiprocessing
 from core.api import Api
 from core.utils import resource_path # Импортируем нашу функцию путей
 
@@ -13,6 +14,8 @@ if not os.path.exists('output'): os.makedirs('output')
 # Пока считаем, что шрифты "вшиты" в программу.
 
 if __name__ == '__main__':
+    # Нужно для пула процессов в собранном exe (PyInstaller, Windows spawn)
+    multiprocessing.freeze_support()
     api = Api()
     
     # Оборачиваем путь к HTML
@@ -662,17 +662,37 @@ function startGen() {
     window.pywebview.api.generate_docs(getConfig());
 }
 function stopGen() { window.pywebview.api.stop_generation().then(alert); }
+let genPaused = false;
+function pauseGen() {
+    genPaused = !genPaused;
+    document.getElementById('pauseBtn').textContent = genPaused ? '▶' : '⏸';
+    if (genPaused) window.pywebview.api.pause_generation();
+    else window.pywebview.api.resume_generation();
+}
 
 function showPreview() {
     if(zones.length === 0) return alert("Нет зон");
     window.pywebview.api.get_preview(getConfig()).then(res => {
         if(res.data) { document.getElementById('previewImg').src = res.data; document.getElementById('previewModal').style.display = 'flex'; } 
-        else alert(res.error);
+        else if(!res.superseded) alert(res.error);
     });
 }
 
-function updateProgress(c,t) { document.getElementById('progressBar').value=c; document.getElementById('progressBar').max=t; document.getElementById('progVal').innerText=`${c}/${t}`; }
-function finishGeneration(m) { alert(m); document.getElementById('progressInfo').style.display='none'; }
+function updateProgress(c,t,info) {
+    document.getElementById('progressBar').value=c; document.getElementById('progressBar').max=t;
+    let txt = `${c}/${t}`;
+    if (info) {
+        if (info.rate) txt += ` · ${info.rate.toFixed(1)} док/с`;
+        if (info.eta !== null && info.eta !== undefined) txt += ` · осталось ${formatEta(info.eta)}`;
+        if (info.errors) txt += ` · ошибок: ${info.errors}`;
+    }
+    document.getElementById('progVal').innerText = txt;
+}
+function formatEta(sec) { sec = Math.round(sec); const m = Math.floor(sec / 60), s = sec % 60; return m ? `${m}:${String(s).padStart(2,'0')}` : `${s} с`; }
+function finishGeneration(m) {
+    genPaused = false; document.getElementById('pauseBtn').textContent = '⏸';
+    alert(m); document.getElementById('progressInfo').style.display='none';
+}
 function closePreview() { document.getElementById('previewModal').style.display='none'; }
 
 function saveProject() { 